@@ -0,0 +1,194 @@
+import argparse
+import asyncio
+import json
+import math
+import os
+import struct
+import sys
+import tempfile
+import time
+
+# Сквозной бенчмарк: socket.io song_changed -> handle_song_change -> PresenceWorker -> Discord IPC.
+# Вместо Discord поднимается локальный discord-ipc-0 (Unix-сокет, протокол pypresence),
+# мост запускается в этом же процессе в фоновом режиме (daemon.BridgeDaemon).
+# Только для Linux/macOS: на Windows pypresence использует именованный канал.
+#
+# python benchmark.py --clients 1 --rate 10 --duration 20 [--no-rate-limit] [--json]
+
+OP_HANDSHAKE = 0
+OP_FRAME = 1
+OP_CLOSE = 2
+OP_PING = 3
+OP_PONG = 4
+
+
+class FakeDiscordIPC:
+    # Минимальная реализация серверной стороны Discord IPC: READY на handshake,
+    # ответ на каждую команду и запись времени получения SET_ACTIVITY
+
+    def __init__(self, directory):
+        self.path = os.path.join(directory, "discord-ipc-0")
+        self.server = None
+        self.activities = []
+
+    async def start(self):
+        self.server = await asyncio.start_unix_server(self._handle, path=self.path)
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    @staticmethod
+    def _send(writer, op, payload):
+        data = json.dumps(payload).encode("utf-8")
+        writer.write(struct.pack("<II", op, len(data)) + data)
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                header = await reader.readexactly(8)
+                op, length = struct.unpack("<II", header)
+                payload = json.loads(await reader.readexactly(length))
+                if op == OP_HANDSHAKE:
+                    self._send(writer, OP_FRAME, {
+                        "cmd": "DISPATCH", "evt": "READY", "nonce": None,
+                        "data": {"v": 1, "user": {"id": "0", "username": "benchmark"}}
+                    })
+                elif op == OP_FRAME:
+                    if payload.get("cmd") == "SET_ACTIVITY":
+                        self.activities.append((time.perf_counter(), payload.get("args", {}).get("activity")))
+                    self._send(writer, OP_FRAME, {
+                        "cmd": payload.get("cmd"), "evt": None, "nonce": payload.get("nonce"),
+                        "data": payload.get("args", {}).get("activity")
+                    })
+                elif op == OP_PING:
+                    self._send(writer, OP_PONG, payload)
+                elif op == OP_CLOSE:
+                    break
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(p / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+async def drive_client(url, client, rate, duration, sent):
+    import socketio
+    sio = socketio.AsyncClient(reconnection=False)
+    await sio.connect(url, transports=["websocket"])
+    interval = 1.0 / rate
+    deadline = time.perf_counter() + duration
+    seq = 0
+    try:
+        while time.perf_counter() < deadline:
+            title = f"bench-{client}-{seq}"
+            sent[title] = time.perf_counter()
+            await sio.emit("song_changed", {"artist": f"client {client}", "songName": title,
+                                            "duration": 180, "position": 0, "source": "VK"})
+            seq += 1
+            await asyncio.sleep(interval)
+    finally:
+        await sio.disconnect()
+
+
+async def run_benchmark(args):
+    # IPC-путь pypresence берётся из XDG_RUNTIME_DIR/TMPDIR - подменяем до первого подключения
+    ipc_dir = tempfile.mkdtemp(prefix="vkrpc-bench-")
+    os.environ["XDG_RUNTIME_DIR"] = ipc_dir
+    os.environ["TMPDIR"] = ipc_dir
+
+    from daemon import BridgeDaemon, load_config
+    from presence import PresenceScheduler
+
+    discord = FakeDiscordIPC(ipc_dir)
+    await discord.start()
+
+    config = load_config(["--port", str(args.port), "--quiet", "--levels", "ERROR",
+                          "--log-dir", os.path.join(ipc_dir, "logs"), "--no-history"])
+    bridge = BridgeDaemon(config)
+    if args.no_rate_limit:
+        bridge.presence_worker.scheduler = PresenceScheduler(rate=1_000_000, per=1.0)
+    bridge_task = asyncio.create_task(bridge.run())
+    while not bridge.server.running or not bridge.presence_worker.connected:
+        if bridge_task.done():
+            bridge_task.result()
+        await asyncio.sleep(0.05)
+
+    sent = {}
+    started = time.perf_counter()
+    await asyncio.gather(*(drive_client(f"http://127.0.0.1:{args.port}", client, args.rate, args.duration, sent)
+                           for client in range(args.clients)))
+    # Даём планировщику отправить финальное состояние
+    await asyncio.sleep(args.settle)
+    elapsed = time.perf_counter() - started
+
+    latencies = []
+    for received_at, activity in discord.activities:
+        title = (activity or {}).get("state")
+        if title in sent:
+            latencies.append((received_at - sent[title]) * 1000)
+
+    bridge.stop()
+    await bridge_task
+    await discord.stop()
+
+    scheduler = bridge.presence_worker.scheduler
+    return {
+        "clients": args.clients,
+        "rate": args.rate,
+        "duration": args.duration,
+        "sent": len(sent),
+        "presence_updates": len(latencies),
+        "dropped": len(sent) - len(latencies),
+        "coalesced": scheduler.coalesced,
+        "suppressed_timeline": bridge.timeline_filter.suppressed,
+        "suppressed_session": bridge.sessions.dropped,
+        "rpc_errors": bridge.metrics.rpc_errors,
+        "throughput": round(len(latencies) / elapsed, 2),
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99)
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк задержки событие -> Discord presence")
+    parser.add_argument("--clients", type=int, default=1)
+    parser.add_argument("--rate", type=float, default=5.0, help="Событий в секунду на клиента")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--port", type=int, default=18112)
+    parser.add_argument("--settle", type=float, default=5.0, help="Сколько ждать после последнего события")
+    parser.add_argument("--no-rate-limit", action="store_true",
+                        help="Отключить лимит Discord в планировщике (чистая задержка конвейера)")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args(argv)
+
+    if sys.platform == "win32":
+        print("Бенчмарк поддерживает только Unix-сокеты Discord IPC", file=sys.stderr)
+        return 1
+    report = asyncio.run(run_benchmark(args))
+    if not report["presence_updates"]:
+        # Ни один SET_ACTIVITY не дошёл до IPC - задержки не измерены, прогон недействителен
+        print(f"Ошибка: presence не обновился ни разу (отправлено событий: {report['sent']}, "
+              f"ошибок RPC: {report['rpc_errors']})", file=sys.stderr)
+        return 1
+    if args.json:
+        print(json.dumps(report))
+    else:
+        for key, value in report.items():
+            if isinstance(value, float):
+                value = f"{value:.2f}"
+            print(f"{key:>20}: {value}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,199 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+
+COVER_DIR = "covers"
+# Сколько секунд обложка с диска считается свежей без запроса к серверу
+COVER_MAX_AGE = 24 * 3600
+COVER_MAX_BYTES = 5 * 1024 * 1024
+# Предельный размер дискового кэша: сверх него удаляются давно не проверявшиеся обложки
+COVER_CACHE_BYTES = 100 * 1024 * 1024
+COVER_TIMEOUT = 10
+
+
+def is_cover_url(url):
+    return isinstance(url, str) and url.startswith(("http://", "https://"))
+
+
+class CoverStore:
+    # Дисковый кэш: файлы по SHA-256 содержимого + index.json с url -> hash/size/ETag/Last-Modified.
+    # Размер ограничен max_bytes: при записи вытесняются адреса с самой старой проверкой
+
+    def __init__(self, directory=COVER_DIR, max_age=COVER_MAX_AGE, max_bytes=COVER_CACHE_BYTES):
+        self.directory = directory
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(directory, "index.json")
+        try:
+            with open(self.index_path, encoding="utf-8") as f:
+                self.index = json.load(f)
+        except (OSError, ValueError):
+            self.index = {}
+
+    def _file(self, digest):
+        return os.path.join(self.directory, digest)
+
+    def lookup(self, url):
+        return self.index.get(url)
+
+    def is_fresh(self, entry):
+        return time.time() - entry.get("checked", 0) < self.max_age
+
+    def read(self, entry):
+        try:
+            with open(self._file(entry["hash"]), "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def store(self, url, data, etag=None, last_modified=None):
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._file(digest)
+        # Одинаковые картинки по разным адресам хранятся один раз
+        if not os.path.exists(path):
+            os.makedirs(self.directory, exist_ok=True)
+            tmp = path + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        self.index[url] = {"hash": digest, "size": len(data), "etag": etag, "last_modified": last_modified,
+                           "checked": time.time()}
+        self._evict()
+        self._save()
+
+    def _size(self, entry):
+        size = entry.get("size")
+        if size is None:
+            # Записи из индекса без размера
+            try:
+                size = entry["size"] = os.path.getsize(self._file(entry["hash"]))
+            except OSError:
+                size = entry["size"] = 0
+        return size
+
+    def _evict(self):
+        # Один файл может принадлежать нескольким адресам - считается и удаляется один раз
+        sizes = {entry["hash"]: self._size(entry) for entry in self.index.values()}
+        total = sum(sizes.values())
+        if total <= self.max_bytes:
+            return
+        users = {}
+        for entry in self.index.values():
+            users[entry["hash"]] = users.get(entry["hash"], 0) + 1
+        for url in sorted(self.index, key=lambda u: self.index[u].get("checked", 0)):
+            if total <= self.max_bytes:
+                break
+            digest = self.index.pop(url)["hash"]
+            users[digest] -= 1
+            if users[digest] == 0:
+                total -= sizes[digest]
+                try:
+                    os.remove(self._file(digest))
+                except OSError:
+                    pass
+
+    def touch(self, url):
+        self.index[url]["checked"] = time.time()
+        self._save()
+
+    def _save(self):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = self.index_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.index, f)
+        os.replace(tmp, self.index_path)
+
+
+class CoverFetcher:
+    # Загрузка обложек в отдельном потоке со своим циклом событий.
+    # on_cover(url, data) вызывается из этого потока; stop() закрывает сессию и цикл.
+
+    def __init__(self, on_cover, store=None):
+        self.on_cover = on_cover
+        self.store = store or CoverStore()
+        self.loop = None
+        self.session = None
+        self.inflight = set()
+        self._ready = threading.Event()
+        self.thread = None
+
+    def _ensure_started(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="cover-fetcher", daemon=True)
+            self.thread.start()
+            self._ready.wait()
+
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self._ready.set()
+        self.loop.run_forever()
+        tasks = asyncio.all_tasks(self.loop)
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+        if self.session is not None:
+            self.loop.run_until_complete(self.session.close())
+        self.loop.close()
+
+    def stop(self, timeout=2.0):
+        if self.thread is None:
+            return
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout)
+
+    def request(self, url):
+        if not is_cover_url(url):
+            return
+        self._ensure_started()
+        self.loop.call_soon_threadsafe(self._schedule, url)
+
+    def _schedule(self, url):
+        if url not in self.inflight:
+            self.inflight.add(url)
+            self.loop.create_task(self._fetch(url))
+
+    async def _fetch(self, url):
+        try:
+            entry = self.store.lookup(url)
+            cached = self.store.read(entry) if entry else None
+            if cached is not None and self.store.is_fresh(entry):
+                self.on_cover(url, cached)
+                return
+            data = await self._download(url, entry if cached is not None else None)
+            if data is None:
+                data = cached
+            if data is not None:
+                self.on_cover(url, data)
+        finally:
+            self.inflight.discard(url)
+
+    async def _download(self, url, entry):
+        from aiohttp import ClientSession, ClientTimeout
+        if self.session is None:
+            self.session = ClientSession(timeout=ClientTimeout(total=COVER_TIMEOUT))
+        headers = {}
+        if entry:
+            # Условная перепроверка: при 304 используем файл с диска
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+        try:
+            async with self.session.get(url, headers=headers) as resp:
+                if resp.status == 304 and entry:
+                    self.store.touch(url)
+                    return None
+                if resp.status != 200 or (resp.content_length or 0) > COVER_MAX_BYTES:
+                    return None
+                data = await resp.content.read(COVER_MAX_BYTES + 1)
+                if len(data) > COVER_MAX_BYTES:
+                    return None
+                self.store.store(url, data, resp.headers.get("ETag"), resp.headers.get("Last-Modified"))
+                return data
+        except Exception:
+            return None
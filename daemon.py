@@ -0,0 +1,191 @@
+import argparse
+import asyncio
+import json
+import signal
+import sys
+import time
+
+from history import HISTORY_DB, HistoryStore, PlayTracker
+from logsink import LOG_DIR, LOG_LEVELS, LogPipeline, RotatingJsonlWriter
+from metrics import Metrics
+from presence import DISCORD_CLIENT_ID, PresenceWorker, RPC_EVENT_LEVELS
+from scrobbler import LASTFM_API_URL, SCROBBLE_EVENT_LEVELS, Scrobbler
+from server import DEFAULT_PORT, BridgeServer
+from sessions import SessionRegistry
+from track import POSITION_DRIFT, TimelineFilter, build_activity, btns
+
+# Фоновый режим без PyQt: socket.io-сервер и Discord Presence в одном цикле событий.
+# Запуск: python daemon.py [--config daemon.json] [--port 8112] ...
+
+DEFAULTS = {
+    "port": DEFAULT_PORT,
+    "host": None,
+    "client_id": DISCORD_CLIENT_ID,
+    "auto_reconnect": True,
+    "log_dir": LOG_DIR,
+    "levels": list(LOG_LEVELS),
+    "quiet": False,
+    "position_drift": POSITION_DRIFT,
+    "history": HISTORY_DB,
+    # Скробблинг (только через --config): включается, когда заданы все три ключа
+    "scrobble_api_key": "",
+    "scrobble_api_secret": "",
+    "scrobble_session_key": "",
+    "scrobble_url": LASTFM_API_URL
+}
+
+
+def load_config(argv=None):
+    parser = argparse.ArgumentParser(description="VK Discord RPC Bridge без графического интерфейса")
+    parser.add_argument("--config", help="JSON-файл с настройками (ключи как у флагов)")
+    parser.add_argument("--port", type=int)
+    parser.add_argument("--host")
+    parser.add_argument("--client-id", dest="client_id")
+    parser.add_argument("--no-reconnect", dest="auto_reconnect", action="store_false", default=None)
+    parser.add_argument("--log-dir", dest="log_dir")
+    parser.add_argument("--levels", type=lambda value: value.split(","),
+                        help="Включённые уровни журнала через запятую, например INFO,ERROR")
+    parser.add_argument("--quiet", action="store_true", default=None, help="Не печатать журнал в stdout")
+    parser.add_argument("--position-drift", dest="position_drift", type=float,
+                        help="Допустимое расхождение позиции в секундах, после которого событие пересылается")
+    parser.add_argument("--history", help="Файл SQLite с историей прослушиваний")
+    parser.add_argument("--no-history", dest="history", action="store_const", const="",
+                        help="Не вести историю прослушиваний")
+    args = parser.parse_args(argv)
+
+    config = dict(DEFAULTS)
+    if args.config:
+        with open(args.config, encoding="utf-8") as f:
+            config.update(json.load(f))
+    config.update({key: value for key, value in vars(args).items() if key != "config" and value is not None})
+    return config
+
+
+class BridgeDaemon:
+    def __init__(self, config):
+        self.config = config
+        self.logger = LogPipeline(config["levels"], RotatingJsonlWriter(config["log_dir"]))
+        if not config["quiet"]:
+            self.logger.subscribe(self.print_message)
+        self.sessions = SessionRegistry()
+        self.timeline_filter = TimelineFilter(config["position_drift"])
+        self.current_track = None
+        self.metrics = Metrics()
+        self.history = HistoryStore(config["history"]) if config["history"] else None
+        self.scrobbler = Scrobbler(config["scrobble_api_key"], config["scrobble_api_secret"],
+                                   config["scrobble_session_key"], config["scrobble_url"],
+                                   on_event=lambda kind, message: self.logger.log(
+                                       message, SCROBBLE_EVENT_LEVELS.get(kind, "INFO")))
+        if not self.scrobbler.configured:
+            self.scrobbler = None
+        self.play_tracker = PlayTracker(self.on_play) if self.history or self.scrobbler else None
+        self.presence_worker = PresenceWorker(config["client_id"], self.on_rpc_event, metrics=self.metrics)
+        self.presence_worker.auto_reconnect = config["auto_reconnect"]
+        self.server = BridgeServer(self.handle_song_change, handle_disconnect=self.handle_disconnect,
+                                   metrics=self.metrics)
+        self.metrics.gauge("events_suppressed_total", lambda: {
+            'reason="timeline"': self.timeline_filter.suppressed,
+            'reason="session"': self.sessions.dropped
+        }, "counter")
+        self.metrics.gauge("discord_connected", lambda: self.presence_worker.connected)
+        self.metrics.gauge("socketio_clients", lambda: len(self.server.clients))
+        # Без метки sid: случайные идентификаторы сессий раздували бы число рядов
+        self.metrics.gauge("socketio_clients_with_rejections", lambda: len(self.server.rejections))
+        if self.history:
+            self.metrics.gauge("history_plays_written_total", lambda: self.history.written, "counter")
+        if self.scrobbler:
+            self.metrics.gauge("scrobble_queue_length", lambda: self.scrobbler.pending)
+            self.metrics.gauge("scrobbles_submitted_total", lambda: self.scrobbler.submitted, "counter")
+        self.stopping = None
+
+    @staticmethod
+    def print_message(message, level):
+        print(f"[{time.strftime('%H:%M:%S')}] [{level}] {message}", flush=True)
+
+    def on_rpc_event(self, kind, message):
+        self.logger.log(message, RPC_EVENT_LEVELS.get(kind, "INFO"))
+
+    async def handle_song_change(self, sid, data):
+        if self.logger.enabled("RECV"):
+            self.logger.log(f"Получены данные: {data}", "RECV", sid=sid)
+        try:
+            forward, state = self.sessions.feed(sid, data)
+            if not forward:
+                return
+            if state is None:
+                self.logger.log("Неполные данные о треке", "WARNING")
+            elif self.play_tracker:
+                self.play_tracker.feed(state)
+            self.publish(state)
+        except Exception as e:
+            self.logger.log(f"Ошибка обработки трека: {str(e)}", "ERROR")
+
+    async def handle_disconnect(self, sid):
+        forward, state = self.sessions.remove(sid)
+        if forward:
+            self.logger.log(f"Источник {sid} отключился", "SERVER")
+            if self.play_tracker:
+                self.play_tracker.feed(state)
+            self.publish(state)
+
+    def on_play(self, play):
+        if self.history:
+            self.history.add(play)
+        if self.scrobbler:
+            self.scrobbler.add(play)
+
+    def publish(self, state):
+        if not self.timeline_filter.accept(state):
+            return
+        self.current_track = state
+        self.presence_worker.post(None if state is None else build_activity(state, btns))
+
+    def stop(self):
+        self.stopping.set()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self.stop)
+            except (NotImplementedError, RuntimeError):
+                # Windows: остаётся KeyboardInterrupt
+                pass
+
+        if self.scrobbler:
+            self.scrobbler.start()
+        self.presence_worker.connect_requested = True
+        worker_task = loop.create_task(self.presence_worker.serve())
+        started = time.perf_counter()
+        await self.server.start_async(self.config["port"], self.config["host"])
+        ready_ms = (time.perf_counter() - started) * 1000
+        self.logger.log(f"Сервер запущен на порту {self.config['port']} за {ready_ms:.0f} мс", "SUCCESS",
+                        ready_ms=ready_ms)
+        try:
+            await self.stopping.wait()
+        finally:
+            self.logger.log("Остановка сервера...", "SERVER")
+            await self.server.stop_async()
+            self.presence_worker.stop()
+            await worker_task
+            if self.play_tracker:
+                self.play_tracker.finish()
+            if self.history:
+                self.history.close()
+            if self.scrobbler:
+                self.scrobbler.stop()
+            self.logger.close()
+
+
+def main(argv=None):
+    daemon = BridgeDaemon(load_config(argv))
+    try:
+        asyncio.run(daemon.run())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,184 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+DIAGNOSTICS_DIR = "diagnostics"
+DIAGNOSTICS_DURATION = 60
+SAMPLE_INTERVAL = 0.005
+SAMPLE_DEPTH = 12
+REPORT_TOP = 25
+
+
+class StageTimers:
+    # Таймеры этапов (ingest, parse, signal, rpc_update, gui_repaint).
+    # Вызывающий код проверяет enabled до замера времени, так что вне диагностики это одна проверка флага.
+    # record() вызывается из потоков сервера, Discord и GUI - статистика под блокировкой.
+
+    def __init__(self):
+        self.enabled = False
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    def reset(self):
+        with self.lock:
+            self.stats = {}
+
+    def record(self, stage, seconds):
+        if not self.enabled:
+            return
+        with self.lock:
+            entry = self.stats.get(stage)
+            if entry is None:
+                self.stats[stage] = [1, seconds, seconds]
+            else:
+                entry[0] += 1
+                entry[1] += seconds
+                if seconds > entry[2]:
+                    entry[2] = seconds
+
+    def report(self):
+        with self.lock:
+            stats = sorted((stage, tuple(entry)) for stage, entry in self.stats.items())
+        lines = [f"{'этап':<14}{'вызовов':>10}{'среднее, мс':>14}{'макс, мс':>12}{'всего, мс':>12}"]
+        for stage, (count, total, peak) in stats:
+            lines.append(f"{stage:<14}{count:>10}{total / count * 1000:>14.3f}{peak * 1000:>12.3f}{total * 1000:>12.1f}")
+        return "\n".join(lines)
+
+
+stage_timers = StageTimers()
+
+
+class StackSampler:
+    # Сэмплирующий профилировщик: периодически снимает стеки всех потоков через sys._current_frames,
+    # в отличие от cProfile видит и поток сервера, и поток Discord
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.samples = Counter()
+        self.total = 0
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="diagnostics-sampler", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        names = {}
+        while self.running:
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < SAMPLE_DEPTH:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                    frame = frame.f_back
+                self.samples[(names.get(ident, str(ident)), " <- ".join(stack))] += 1
+            self.total += 1
+            time.sleep(self.interval)
+
+    def report(self, top=REPORT_TOP):
+        lines = [f"Снимков: {self.total}"]
+        for (thread, stack), count in self.samples.most_common(top):
+            lines.append(f"{count:>7}  [{thread}] {stack}")
+        return "\n".join(lines)
+
+
+class DiagnosticsSession:
+    # Окно диагностики: cProfile (поток GUI), сэмплирование стеков всех потоков, tracemalloc
+    # и таймеры этапов. stop() записывает текстовый отчёт и возвращает путь к нему.
+
+    def __init__(self, directory=DIAGNOSTICS_DIR, duration=DIAGNOSTICS_DURATION):
+        self.directory = directory
+        self.duration = duration
+        self.profile = None
+        self.sampler = None
+        self.snapshot = None
+        self.started = None
+        self.owns_tracemalloc = False
+
+    def start(self):
+        import cProfile
+        import tracemalloc
+        self.started = time.time()
+        stage_timers.reset()
+        stage_timers.enabled = True
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(10)
+            self.owns_tracemalloc = True
+        self.snapshot = tracemalloc.take_snapshot()
+        self.sampler = StackSampler()
+        self.sampler.start()
+        # enable() падает, если уже работает другой профилировщик (sys.setprofile / sys.monitoring)
+        profile = cProfile.Profile()
+        profile.enable()
+        self.profile = profile
+
+    def cancel(self):
+        # Откат частично запущенной сессии (ошибка в start) без отчёта
+        import tracemalloc
+        stage_timers.enabled = False
+        if self.profile is not None:
+            self.profile.disable()
+        if self.sampler is not None:
+            self.sampler.stop()
+        if self.owns_tracemalloc:
+            tracemalloc.stop()
+            self.owns_tracemalloc = False
+
+    def stop(self, extra=None):
+        import io
+        import pstats
+        import tracemalloc
+        self.profile.disable()
+        self.sampler.stop()
+        stage_timers.enabled = False
+        current = tracemalloc.take_snapshot()
+        traced, peak = tracemalloc.get_traced_memory()
+        if self.owns_tracemalloc:
+            tracemalloc.stop()
+
+        out = io.StringIO()
+        out.write("Диагностика VK Discord RPC Bridge\n")
+        out.write(f"Начало: {datetime.fromtimestamp(self.started):%Y-%m-%d %H:%M:%S}, "
+                  f"длительность: {time.time() - self.started:.1f} с\n")
+        out.write(f"Python {sys.version.split()[0]} на {sys.platform}\n")
+        for key, value in (extra or {}).items():
+            out.write(f"{key}: {value}\n")
+
+        out.write("\n== Таймеры этапов ==\n")
+        out.write(stage_timers.report() + "\n")
+
+        out.write("\n== Сэмплирование стеков ==\n")
+        out.write(self.sampler.report() + "\n")
+
+        out.write(f"\n== Память (tracemalloc): сейчас {traced / 1024:.0f} КиБ, пик {peak / 1024:.0f} КиБ ==\n")
+        out.write("Рост за время диагностики:\n")
+        for stat in current.compare_to(self.snapshot, "lineno")[:REPORT_TOP]:
+            out.write(f"  {stat}\n")
+        out.write("Крупнейшие размещения:\n")
+        for stat in current.statistics("lineno")[:REPORT_TOP]:
+            out.write(f"  {stat}\n")
+
+        out.write("\n== cProfile (поток GUI) ==\n")
+        stats = pstats.Stats(self.profile, stream=out)
+        stats.sort_stats("cumulative").print_stats(REPORT_TOP * 2)
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"diagnostics-{datetime.fromtimestamp(self.started):%Y%m%d-%H%M%S}.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(out.getvalue())
+        return os.path.abspath(path)
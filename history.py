@@ -0,0 +1,191 @@
+import queue
+import sqlite3
+import threading
+import time
+
+HISTORY_DB = "history.sqlite3"
+# Писатель копит прослушивания и записывает их одной транзакцией не реже этого интервала (секунды)
+HISTORY_FLUSH_INTERVAL = 2.0
+HISTORY_BATCH = 500
+# Короче этого (секунды) прослушивание не сохраняется - пролистанные треки
+HISTORY_MIN_LISTENED = 5.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS plays (
+    id INTEGER PRIMARY KEY,
+    started REAL NOT NULL,
+    artist TEXT NOT NULL,
+    title TEXT NOT NULL,
+    album TEXT NOT NULL DEFAULT '',
+    duration REAL NOT NULL DEFAULT 0,
+    listened REAL NOT NULL
+);
+-- Покрывающий индекс: топы за период читаются по диапазону started без обращения к таблице
+CREATE INDEX IF NOT EXISTS plays_started ON plays (started, artist, title, listened);
+"""
+
+_STOP = object()
+
+
+class Play:
+    __slots__ = ("started", "artist", "title", "album", "duration", "listened")
+
+    def __init__(self, started, artist, title, album, duration, listened):
+        self.started = started
+        self.artist = artist
+        self.title = title
+        self.album = album
+        self.duration = duration
+        self.listened = listened
+
+    def row(self):
+        return self.started, self.artist, self.title, self.album, self.duration, self.listened
+
+
+class PlayTracker:
+    # Превращает поток TrackState в прослушивания: время считается только вне паузы,
+    # прослушивание завершается при смене трека или отключении источника и передаётся в on_play
+
+    def __init__(self, on_play, min_listened=HISTORY_MIN_LISTENED, clock=time.monotonic, wall=time.time):
+        self.on_play = on_play
+        self.min_listened = min_listened
+        self.clock = clock
+        self.wall = wall
+        self.state = None
+        self.started = 0.0
+        self.listened = 0.0
+        self.resumed_at = None
+
+    def feed(self, state):
+        now = self.clock()
+        if state is not None and state.same_track(self.state):
+            if state.paused and self.resumed_at is not None:
+                self.listened += now - self.resumed_at
+                self.resumed_at = None
+            elif not state.paused and self.resumed_at is None:
+                self.resumed_at = now
+            self.state = state
+            return
+        self.finish(now)
+        self.state = state
+        if state is not None:
+            self.started = self.wall()
+            self.listened = 0.0
+            self.resumed_at = None if state.paused else now
+
+    def finish(self, now=None):
+        state = self.state
+        if state is None:
+            return
+        if self.resumed_at is not None:
+            self.listened += (now if now is not None else self.clock()) - self.resumed_at
+            self.resumed_at = None
+        self.state = None
+        if self.listened >= self.min_listened:
+            self.on_play(Play(self.started, state.artist, state.title, state.album or "",
+                              state.duration, round(self.listened, 1)))
+
+
+class HistoryStore:
+    # История прослушиваний в SQLite (WAL). add() только кладёт запись в очередь -
+    # пишет фоновый поток пачками, поэтому путь события не ждёт диска.
+    # Чтение идёт через отдельные соединения (своё у каждого потока) и в WAL не блокируется записью
+
+    def __init__(self, path=HISTORY_DB, flush_interval=HISTORY_FLUSH_INTERVAL):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.queue = queue.SimpleQueue()
+        self.local = threading.local()
+        self.readers = []
+        self.written = 0
+        connection = self._connect()
+        connection.executescript(SCHEMA)
+        connection.close()
+        self.thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+        self.thread.start()
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def add(self, play):
+        self.queue.put(play)
+
+    def close(self, timeout=2.0):
+        self.queue.put(_STOP)
+        self.thread.join(timeout)
+        for reader in self.readers:
+            reader.close()
+        self.readers = []
+
+    def _run(self):
+        connection = self._connect()
+        stopped = False
+        while not stopped:
+            batch = [self.queue.get()]
+            # Ждём попутчиков до flush_interval, чтобы одна транзакция покрыла несколько записей
+            deadline = time.monotonic() + self.flush_interval
+            while batch[-1] is not _STOP and len(batch) < HISTORY_BATCH:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            rows = []
+            for play in batch:
+                if play is _STOP:
+                    stopped = True
+                    continue
+                rows.append(play.row())
+            if rows:
+                try:
+                    with connection:
+                        connection.executemany("INSERT INTO plays (started, artist, title, album, duration, listened)"
+                                               " VALUES (?, ?, ?, ?, ?, ?)", rows)
+                    self.written += len(rows)
+                except sqlite3.Error:
+                    pass
+        connection.close()
+
+    def _query(self, sql, params=()):
+        reader = getattr(self.local, "reader", None)
+        if reader is None:
+            reader = self.local.reader = self._connect()
+            self.readers.append(reader)
+        return reader.execute(sql, params).fetchall()
+
+    def release_reader(self):
+        # Для короткоживущих потоков: закрыть соединение текущего потока
+        reader = getattr(self.local, "reader", None)
+        if reader is not None:
+            self.local.reader = None
+            self.readers.remove(reader)
+            reader.close()
+
+    def top_artists(self, since=0.0, until=None, limit=10):
+        # [(исполнитель, прослушиваний, секунд)]
+        return self._query("SELECT artist, COUNT(*), SUM(listened) FROM plays WHERE started >= ? AND started < ?"
+                           " GROUP BY artist ORDER BY COUNT(*) DESC, SUM(listened) DESC LIMIT ?",
+                           (since, until if until is not None else float("inf"), limit))
+
+    def top_tracks(self, since=0.0, until=None, limit=10):
+        # [(исполнитель, название, прослушиваний, секунд)]
+        return self._query("SELECT artist, title, COUNT(*), SUM(listened) FROM plays WHERE started >= ? AND started < ?"
+                           " GROUP BY artist, title ORDER BY COUNT(*) DESC, SUM(listened) DESC LIMIT ?",
+                           (since, until if until is not None else float("inf"), limit))
+
+    def recent(self, before=None, limit=200):
+        # Страница истории от новых к старым; следующая страница - before=id последней строки.
+        # Выборка по rowid не замедляется с ростом таблицы, в отличие от OFFSET
+        if before is None:
+            return self._query("SELECT id, started, artist, title, album, listened FROM plays"
+                               " ORDER BY id DESC LIMIT ?", (limit,))
+        return self._query("SELECT id, started, artist, title, album, listened FROM plays"
+                           " WHERE id < ? ORDER BY id DESC LIMIT ?", (before, limit))
+
+    def count(self):
+        return self._query("SELECT COUNT(*) FROM plays")[0][0]
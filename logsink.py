@@ -0,0 +1,149 @@
+import json
+import os
+import queue
+import threading
+import time
+
+LOG_LEVELS = ("INFO", "SUCCESS", "WARNING", "ERROR", "RPC", "SERVER", "RECV")
+LOG_DIR = "logs"
+LOG_FILE = "bridge.jsonl"
+LOG_MAX_BYTES = 1024 * 1024
+LOG_BACKUPS = 3
+
+_STOP = object()
+
+
+class RotatingJsonlWriter:
+    # Фоновый поток: пишет записи в JSONL и ротирует файл по размеру (bridge.jsonl -> bridge.jsonl.1 ...).
+    # Ошибки диска не останавливают поток: записи, которые некуда писать, отбрасываются (dropped),
+    # а после завершения потока put() перестаёт копить их в очереди
+
+    def __init__(self, directory=LOG_DIR, filename=LOG_FILE, max_bytes=LOG_MAX_BYTES, backups=LOG_BACKUPS):
+        self.path = os.path.join(directory, filename)
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.queue = queue.SimpleQueue()
+        self.file = None
+        self.alive = True
+        self.dropped = 0
+        self.thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self.thread.start()
+
+    def put(self, record):
+        if not self.alive:
+            self.dropped += 1
+            return
+        self.queue.put(record)
+
+    def close(self, timeout=2.0):
+        self.queue.put(_STOP)
+        self.thread.join(timeout)
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.file = open(self.path, "a", encoding="utf-8")
+
+    def _close(self):
+        file, self.file = self.file, None
+        if file is not None:
+            try:
+                file.close()
+            except OSError:
+                pass
+
+    def _rotate(self):
+        self._close()
+        try:
+            for i in range(self.backups - 1, 0, -1):
+                src = f"{self.path}.{i}"
+                if os.path.exists(src):
+                    os.replace(src, f"{self.path}.{i + 1}")
+            if self.backups > 0:
+                os.replace(self.path, f"{self.path}.1")
+            else:
+                os.remove(self.path)
+        except OSError:
+            # Файл занят другим процессом (Windows) - продолжаем дописывать текущий,
+            # ротация повторится после следующей пачки
+            pass
+        finally:
+            self._open()
+
+    def _run(self):
+        try:
+            self._serve()
+        finally:
+            self.alive = False
+            self._close()
+
+    def _serve(self):
+        stopped = False
+        while not stopped:
+            batch = [self.queue.get()]
+            # Забираем всё, что накопилось, и пишем одной пачкой
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            lines = []
+            for record in batch:
+                if record is _STOP:
+                    stopped = True
+                    continue
+                lines.append(json.dumps(record, ensure_ascii=False, default=str))
+            if not lines:
+                continue
+            try:
+                # Файл не открылся (при запуске или после ротации) - пробуем снова на каждой пачке
+                if self.file is None:
+                    self._open()
+                self.file.write("\n".join(lines) + "\n")
+                self.file.flush()
+            except (OSError, ValueError):
+                self.dropped += len(lines)
+                self._close()
+                continue
+            try:
+                if self.file.tell() >= self.max_bytes:
+                    self._rotate()
+            except (OSError, ValueError):
+                self._close()
+
+
+class LogPipeline:
+    # Единая точка логирования: фильтр по уровням, подписчики (GUI) и фоновая запись в файл.
+    # Дорогое форматирование проверяется через enabled(level) до построения строки.
+
+    def __init__(self, levels=LOG_LEVELS, writer=None):
+        self.levels = set(levels)
+        self.writer = writer
+        self.subscribers = []
+
+    def enabled(self, level):
+        return level in self.levels
+
+    def set_level(self, level, enabled):
+        if enabled:
+            self.levels.add(level)
+        else:
+            self.levels.discard(level)
+
+    def subscribe(self, callback):
+        self.subscribers.append(callback)
+
+    def log(self, message, level="INFO", **fields):
+        if level not in self.levels:
+            return
+        for callback in self.subscribers:
+            callback(message, level)
+        if self.writer is not None:
+            record = {"ts": time.time(), "level": level, "message": message}
+            if fields:
+                record.update(fields)
+            self.writer.put(record)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
@@ -1,36 +1,96 @@
+import time
+
+# Отметка начала запуска - для отчёта о времени старта
+STARTUP_T0 = time.perf_counter()
+
 import hashlib
+import json
 import signal
-import zipfile
 import io
-import json
-import time
 import sys
 import os
-import requests
 import subprocess
 from datetime import datetime
 from PyQt5.QtWidgets import QApplication, QMainWindow, QLabel, QPushButton, QVBoxLayout, QWidget, \
-    QSystemTrayIcon, QMenu, QMessageBox, QProgressBar, QListWidget, QHBoxLayout, QFrame, QListWidgetItem, QDialog, \
-    QGraphicsDropShadowEffect, QLineEdit, QCheckBox, QGroupBox, QScrollArea, QSizePolicy
-from PyQt5.QtCore import QTimer, pyqtSignal, QObject, Qt, QThread, QPropertyAnimation, QSize, QPoint, QEasingCurve
-from PyQt5.QtGui import QIcon, QPixmap, QColor, QPainter, QLinearGradient, QBrush, QFont, QFontDatabase, QPalette, QPen
-from pypresence import Presence, DiscordNotFound
-from socketio import AsyncServer
-from aiohttp import web, ClientSession
+    QSystemTrayIcon, QMenu, QMessageBox, QProgressBar, QListView, QHBoxLayout, QFrame, QDialog, \
+    QGraphicsEffect, QGraphicsBlurEffect, QGraphicsScene, QGraphicsPixmapItem, QLineEdit, QCheckBox, QGroupBox, \
+    QScrollArea, QSizePolicy, QSpinBox, QComboBox, QListWidget, QFormLayout
+from PyQt5.QtCore import QTimer, pyqtSignal, QObject, Qt, QThread, QPropertyAnimation, QSize, QPoint, QEasingCurve, \
+    QRect, QRectF, QAbstractListModel, QModelIndex, QEvent
+from PyQt5.QtGui import QIcon, QImage, QPixmap, QColor, QPainter, QLinearGradient, QBrush, QFont, QFontDatabase, \
+    QPalette, QPen
 import asyncio
 import threading
-from packaging import version
-import speech_recognition as sr
+from collections import OrderedDict
+from covers import CoverFetcher
+from diagnostics import DIAGNOSTICS_DURATION, DiagnosticsSession, stage_timers
+from history import HistoryStore, PlayTracker
+from logsink import LOG_LEVELS, LogPipeline, RotatingJsonlWriter
+from metrics import Metrics, process_context_switches
+from presence import DISCORD_CLIENT_ID, PresenceWorker, RPC_EVENT_LEVELS
+from scrobbler import SCROBBLE_EVENT_LEVELS, Scrobbler
+from server import BridgeServer
+from sessions import SessionRegistry
+from settings import LIMITS, LOG_CAPACITY, SCROBBLE_KEYS, SettingsStore
+from track import TimelineFilter, build_activity, btns, extrapolate_position
+from updater import MANIFEST_NAME, UPDATE_FILE, ReleaseCache, UpdateDownloader, UpdateError, UpdateInstaller, \
+    fetch_latest_release, find_sha256
 
 # Константы
-DISCORD_CLIENT_ID = '1381313733845975261'
 VERSION = "1.3.0"
 GITHUB_REPO = "Drakkkyla/vk-rpc-bridge"
 GITHUB_URL = f"https://github.com/{GITHUB_REPO}"
-btns = [
-    {"label": "Github", "url": "https://github.com/Drakkkyla/vk-rpc-bridge"},
-    {"label": "VK", "url": "https://vk.com/draakylaaaa"}
-]
+LOG_FLUSH_INTERVAL = 100
+# Строк истории, подгружаемых за один fetchMore
+HISTORY_PAGE = 200
+# Периоды для топов в окне истории (секунды; None - за всё время)
+HISTORY_PERIODS = (("За день", 86400), ("За неделю", 7 * 86400), ("За месяц", 30 * 86400), ("За всё время", None))
+# Обложки: размер на экране и сколько готовых QPixmap держать в памяти
+COVER_SIZE = 250
+COVER_LRU_SIZE = 64
+# Шаг таймера прогресса: один процент трека, но в этих пределах (мс)
+PROGRESS_MIN_INTERVAL = 250
+PROGRESS_MAX_INTERVAL = 5000
+# Тень карточек: рисуется из заранее размытой заготовки, а не размывается при каждой перерисовке
+SHADOW_BLUR = 25
+SHADOW_OFFSET = 5
+SHADOW_ALPHA = 180
+CARD_RADIUS = 15
+LOG_COLORS = {
+    "INFO": "#66b3ff",
+    "SUCCESS": "#4CAF50",
+    "WARNING": "#FFA500",
+    "ERROR": "#ff4444",
+    "RPC": "#9c27b0",
+    "SERVER": "#FF9800",
+    "RECV": "#9C27B0"
+}
+LOG_ICONS = {
+    "INFO": "info.svg",
+    "SUCCESS": "success.svg",
+    "WARNING": "warning.svg",
+    "ERROR": "error.svg",
+    "RPC": "rpc.svg",
+    "SERVER": "server.svg",
+    "RECV": "receive.svg"
+}
+
+
+class StartupReport:
+    # Время этапов запуска от первой строки main.py, чтобы регрессии было видно в журнале
+    def __init__(self, t0):
+        self.t0 = t0
+        self.stages = []
+
+    def mark(self, stage):
+        self.stages.append((stage, (time.perf_counter() - self.t0) * 1000))
+
+    def summary(self):
+        return ", ".join(f"{stage} {ms:.0f} мс" for stage, ms in self.stages)
+
+
+startup_report = StartupReport(STARTUP_T0)
+startup_report.mark("импорт")
 
 
 def resource_path(relative_path):
@@ -59,8 +119,21 @@ class ModernProgressBar(QProgressBar):
         painter.setBrush(QColor(45, 45, 60))
         painter.drawRoundedRect(bg_rect, 3, 3)
 
+        # Заполненная часть
+        span = self.maximum() - self.minimum()
+        width = int(bg_rect.width() * (self.value() - self.minimum()) / span) if span > 0 else 0
+        if width > 0:
+            gradient = QLinearGradient(0, 0, bg_rect.width(), 0)
+            gradient.setColorAt(0, QColor("#7289DA"))
+            gradient.setColorAt(1, QColor("#9B59B6"))
+            painter.setBrush(QBrush(gradient))
+            painter.drawRoundedRect(0, 0, width, bg_rect.height(), 3, 3)
+
 
 class AnimatedButton(QPushButton):
+    # Выключается настройкой "effects"
+    animated = True
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.setCursor(Qt.PointingHandCursor)
@@ -69,6 +142,9 @@ class AnimatedButton(QPushButton):
         self.animation.setEasingCurve(QEasingCurve.OutBack)
 
     def enterEvent(self, event):
+        if not self.animated:
+            super().enterEvent(event)
+            return
         self.animation.stop()
         self.animation.setStartValue(self.geometry())
         self.animation.setEndValue(self.geometry().adjusted(-5, -5, 5, 5))
@@ -76,6 +152,9 @@ class AnimatedButton(QPushButton):
         super().enterEvent(event)
 
     def leaveEvent(self, event):
+        if not self.animated:
+            super().leaveEvent(event)
+            return
         self.animation.stop()
         self.animation.setStartValue(self.geometry())
         self.animation.setEndValue(self.geometry().adjusted(5, 5, -5, -5))
@@ -83,15 +162,92 @@ class AnimatedButton(QPushButton):
         super().leaveEvent(event)
 
 
+_shadow_cache = {}
+
+
+def shadow_pixmap(radius, blur, alpha):
+    # Размытая тень минимального прямоугольника со скруглёнными углами: углы и края
+    # растягиваются на любой размер (nine-slice), поэтому заготовка одна на (радиус, размытие, цвет)
+    key = (radius, blur, alpha)
+    pixmap = _shadow_cache.get(key)
+    if pixmap is not None:
+        return pixmap
+    # Прямоугольник должен выходить за средний столбец/строку на blur + radius с каждой стороны,
+    # иначе размытие не добирает полной силы и края после растяжения бледнее живой тени
+    inner = 2 * (blur + radius) + 1
+    size = inner + 2 * blur
+    shape = QImage(size, size, QImage.Format_ARGB32_Premultiplied)
+    shape.fill(Qt.transparent)
+    painter = QPainter(shape)
+    painter.setRenderHint(QPainter.Antialiasing)
+    painter.setPen(Qt.NoPen)
+    painter.setBrush(QColor(0, 0, 0, alpha))
+    painter.drawRoundedRect(blur, blur, inner, inner, radius, radius)
+    painter.end()
+
+    # Размытие один раз через QGraphicsBlurEffect на временной сцене
+    scene = QGraphicsScene()
+    item = QGraphicsPixmapItem(QPixmap.fromImage(shape))
+    effect = QGraphicsBlurEffect()
+    effect.setBlurRadius(blur)
+    item.setGraphicsEffect(effect)
+    scene.addItem(item)
+    blurred = QImage(size, size, QImage.Format_ARGB32_Premultiplied)
+    blurred.fill(Qt.transparent)
+    painter = QPainter(blurred)
+    scene.render(painter, QRectF(0, 0, size, size), QRectF(0, 0, size, size))
+    painter.end()
+    pixmap = _shadow_cache[key] = QPixmap.fromImage(blurred)
+    return pixmap
+
+
+def draw_nine_slice(painter, target, pixmap, corner):
+    # Углы corner x corner рисуются как есть, края и середина растягиваются
+    corner = min(corner, target.width() // 2, target.height() // 2)
+    size = pixmap.width()
+    middle = size - 2 * corner
+    x = (target.left(), target.left() + corner, target.right() + 1 - corner)
+    y = (target.top(), target.top() + corner, target.bottom() + 1 - corner)
+    widths = (corner, target.width() - 2 * corner, corner)
+    heights = (corner, target.height() - 2 * corner, corner)
+    sources = ((0, corner), (corner, middle), (size - corner, corner))
+    for row in range(3):
+        for column in range(3):
+            if widths[column] > 0 and heights[row] > 0:
+                painter.drawPixmap(QRect(x[column], y[row], widths[column], heights[row]), pixmap,
+                                   QRect(sources[column][0], sources[row][0], sources[column][1], sources[row][1]))
+
+
+class CachedShadowEffect(QGraphicsEffect):
+    # Замена QGraphicsDropShadowEffect: тень из кеша, виджет рисуется напрямую (drawSource) без
+    # промежуточного пиксмапа - перерисовки при наведении и изменении размера не пересчитывают размытие
+
+    def __init__(self, radius=CARD_RADIUS, blur=SHADOW_BLUR, offset=SHADOW_OFFSET, alpha=SHADOW_ALPHA, parent=None):
+        super().__init__(parent)
+        self.radius = radius
+        self.blur = blur
+        self.offset = offset
+        self.alpha = alpha
+
+    def boundingRectFor(self, rect):
+        return rect.united(rect.adjusted(-self.blur, -self.blur + self.offset, self.blur, self.blur + self.offset))
+
+    def draw(self, painter):
+        rect = self.sourceBoundingRect(Qt.LogicalCoordinates).toRect()
+        target = rect.adjusted(-self.blur, -self.blur, self.blur, self.blur).translated(0, self.offset)
+        draw_nine_slice(painter, target, shadow_pixmap(self.radius, self.blur, self.alpha),
+                        2 * self.blur + self.radius)
+        self.drawSource(painter)
+
+
 def create_shadow():
-    shadow = QGraphicsDropShadowEffect()
-    shadow.setBlurRadius(25)
-    shadow.setColor(QColor(0, 0, 0, 180))
-    shadow.setOffset(0, 5)
-    return shadow
+    return CachedShadowEffect()
 
 
 class GlassCard(QFrame):
+    # Выключается настройкой "effects"
+    shadows = True
+
     def __init__(self, parent=None):
         super().__init__(parent)
         self.setStyleSheet("""
@@ -101,10 +257,150 @@ class GlassCard(QFrame):
                 border: 1px solid rgba(255, 255, 255, 0.1);
             }
         """)
-        self.setGraphicsEffect(create_shadow())
+        if self.shadows:
+            self.setGraphicsEffect(create_shadow())
+
+
+def apply_effects(enabled):
+    # Тени карточек и анимации кнопок; уже созданные карточки переключаются сразу
+    AnimatedButton.animated = enabled
+    GlassCard.shadows = enabled
+    for widget in QApplication.allWidgets():
+        if isinstance(widget, GlassCard):
+            widget.setGraphicsEffect(create_shadow() if enabled else None)
+
+
+class LogModel(QAbstractListModel):
+    # Журнал на кольцевом буфере: старые записи вытесняются, новые копятся
+    # в pending и добавляются в модель пачкой по таймеру
+    flushed = pyqtSignal()
+
+    def __init__(self, capacity=LOG_CAPACITY, parent=None):
+        super().__init__(parent)
+        # Кольцевой буфер не работает с нулевой ёмкостью (срез [-0:] и деление по модулю на 0)
+        capacity = max(1, capacity)
+        self.capacity = capacity
+        self.buffer = [None] * capacity
+        self.start = 0
+        self.count = 0
+        self.pending = []
+        # Окно скрыто: записи только копятся в pending, таймер не запускается
+        self.suspended = False
+        self.colors = {level: QColor(color) for level, color in LOG_COLORS.items()}
+        self.default_color = QColor("#ffffff")
+        self.icons = {}
+        self.flush_timer = QTimer(self)
+        self.flush_timer.setSingleShot(True)
+        self.flush_timer.setInterval(LOG_FLUSH_INTERVAL)
+        self.flush_timer.timeout.connect(self.flush)
+
+    def append(self, message, level="INFO"):
+        timestamp = datetime.now().strftime("%H:%M:%S.%f")[:-3]
+        self.pending.append((f"[{timestamp}] [{level}] {message}", level))
+        if self.suspended:
+            # Всё равно попадут только последние capacity записей
+            if len(self.pending) > 2 * self.capacity:
+                del self.pending[:-self.capacity]
+        elif not self.flush_timer.isActive():
+            self.flush_timer.start()
+
+    def set_suspended(self, suspended):
+        self.suspended = suspended
+        if suspended:
+            self.flush_timer.stop()
+        else:
+            self.flush()
+
+    def flush(self):
+        batch, self.pending = self.pending[-self.capacity:], []
+        if not batch:
+            return
+        overflow = self.count + len(batch) - self.capacity
+        if overflow > 0:
+            self.beginRemoveRows(QModelIndex(), 0, overflow - 1)
+            for i in range(overflow):
+                self.buffer[(self.start + i) % self.capacity] = None
+            self.start = (self.start + overflow) % self.capacity
+            self.count -= overflow
+            self.endRemoveRows()
+        self.beginInsertRows(QModelIndex(), self.count, self.count + len(batch) - 1)
+        for entry in batch:
+            self.buffer[(self.start + self.count) % self.capacity] = entry
+            self.count += 1
+        self.endInsertRows()
+        self.flushed.emit()
+
+    def set_capacity(self, capacity):
+        capacity = max(1, capacity)
+        if capacity == self.capacity:
+            return
+        self.beginResetModel()
+        entries = [self.buffer[(self.start + i) % self.capacity] for i in range(self.count)][-capacity:]
+        self.capacity = capacity
+        self.buffer = entries + [None] * (capacity - len(entries))
+        self.start = 0
+        self.count = len(entries)
+        self.endResetModel()
+
+    def icon(self, level):
+        icon = self.icons.get(level)
+        if icon is None and level in LOG_ICONS:
+            icon = self.icons[level] = QIcon(resource_path(LOG_ICONS[level]))
+        return icon
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self.count
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or index.row() >= self.count:
+            return None
+        text, level = self.buffer[(self.start + index.row()) % self.capacity]
+        if role == Qt.DisplayRole:
+            return text
+        if role == Qt.ForegroundRole:
+            return self.colors.get(level, self.default_color)
+        if role == Qt.DecorationRole:
+            return self.icon(level)
+        return None
+
+
+class HistoryModel(QAbstractListModel):
+    # История прослушиваний постранично: в модели только уже показанные строки,
+    # следующая страница читается по id, когда список докручен до конца
+
+    def __init__(self, store, parent=None):
+        super().__init__(parent)
+        self.store = store
+        self.rows = []
+        self.exhausted = False
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self.exhausted
+
+    def fetchMore(self, parent=QModelIndex()):
+        page = self.store.recent(self.rows[-1][0] if self.rows else None, HISTORY_PAGE)
+        if len(page) < HISTORY_PAGE:
+            self.exhausted = True
+        if not page:
+            return
+        self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(page) - 1)
+        self.rows.extend(page)
+        self.endInsertRows()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role != Qt.DisplayRole:
+            return None
+        row_id, started, artist, title, album, listened = self.rows[index.row()]
+        return (f"{datetime.fromtimestamp(started):%d.%m.%Y %H:%M}  {artist} - {title}"
+                f"  ({int(listened) // 60}:{int(listened) % 60:02d})")
 
 
 class UpdateManager(QThread):
+    # Один конвейер обновления на приложение: фоновая проверка скачивает и готовит обновление,
+    # UpdateDialog только подписывается на его сигналы
     progress_signal = pyqtSignal(int)
     message_signal = pyqtSignal(str)
     complete_signal = pyqtSignal()
@@ -114,59 +410,110 @@ class UpdateManager(QThread):
     def __init__(self):
         super().__init__()
         self.session = None
-        self.download_task = None
+        self.downloader = None
+        self.installer = UpdateInstaller()
+        self.cache = ReleaseCache()
         self.update_info = None
-        self.cancelled = False
-
-    async def check_updates_async(self):
+        # Обновление скачано и подготовлено в .update/staging
+        self.ready = False
+        self.progress = 0
+        self._cancelled = False
+
+    @property
+    def cancelled(self):
+        return self._cancelled
+
+    @cancelled.setter
+    def cancelled(self, value):
+        self._cancelled = value
+        self.installer.cancelled = value
+        for downloader in (self.downloader, self.installer.downloader):
+            if downloader is not None:
+                downloader.cancelled = value
+
+    async def check_updates_async(self, session):
+        from packaging import version
+        data = await fetch_latest_release(session, GITHUB_REPO, self.cache)
+        latest_version = data["tag_name"]
+        if version.parse(latest_version) <= version.parse(VERSION):
+            return False
+        if self.cache.resolved is None:
+            assets = data["assets"]
+            asset = next((a for a in assets if a["name"].endswith(".zip")), assets[0])
+            self.cache.resolved = {
+                "version": latest_version,
+                "url": asset["browser_download_url"],
+                "sha256": await find_sha256(session, asset, assets),
+                "manifest": await self.fetch_manifest(session, latest_version, assets)
+            }
+            self.cache.save()
+        self.update_info = self.cache.resolved
+        return True
+
+    @staticmethod
+    async def fetch_manifest(session, tag, assets):
+        # manifest.json релиза: {"files": {"путь": {"sha256": ..., "size": ...}}, "base_url": ...}.
+        # Без манифеста обновление ставится целиком из архива
+        asset = next((a for a in assets if a["name"] == MANIFEST_NAME), None)
+        if asset is None:
+            return None
+        sha256 = await find_sha256(session, asset, assets)
+        async with session.get(asset["browser_download_url"]) as resp:
+            resp.raise_for_status()
+            body = await resp.read()
+        if sha256 and hashlib.sha256(body).hexdigest() != sha256:
+            raise UpdateError("Ошибка проверки хеша манифеста")
+        manifest = json.loads(body)
+        manifest.setdefault("base_url", f"https://raw.githubusercontent.com/{GITHUB_REPO}/{tag}/")
+        return manifest
+
+    def _on_progress(self, downloaded, total):
+        if total:
+            self.progress = int(100 * downloaded / total)
+            self.progress_signal.emit(self.progress)
+
+    async def download_update_async(self, session):
+        # Результат - подготовленный каталог .update/staging, установка в install_update
+        manifest = self.update_info["manifest"]
+        if manifest is not None:
+            count, size = await self.installer.stage_manifest(session, manifest, manifest["base_url"],
+                                                              on_progress=self._on_progress)
+            self.message_signal.emit(f"Изменённых файлов: {count} ({size / 1024:.0f} КиБ)")
+            return
+        self.downloader = UpdateDownloader(self.update_info["url"], self.update_info["sha256"],
+                                           on_progress=self._on_progress)
+        self.downloader.cancelled = self._cancelled
+        await self.downloader.download(session)
+        self.installer.stage_zip(UPDATE_FILE)
+
+    async def run_async(self):
+        from aiohttp import ClientSession
         async with ClientSession() as session:
-            async with session.get(f"https://api.github.com/repos/{GITHUB_REPO}/releases/latest") as resp:
-                data = await resp.json()
-                latest_version = data["tag_name"]
-                if version.parse(latest_version) > version.parse(VERSION):
-                    self.update_info = {
-                        "version": latest_version,
-                        "url": data["assets"][0]["browser_download_url"]
-                    }
-                    return True
-        return False
-
-    async def download_update_async(self):
-        async with ClientSession() as session, session.get(self.update_info["url"]) as resp:
-            total = int(resp.headers.get("Content-Length", 0))
-            downloaded = 0
-            with open("update.zip", "wb") as f:
-                async for chunk in resp.content.iter_chunked(8192):
-                    if self.cancelled:
-                        raise Exception("Отменено")
-                    f.write(chunk)
-                    downloaded += len(chunk)
-                    self.progress_signal.emit(int(100 * downloaded / total))
-                    await asyncio.sleep(0.01)
+            if await self.check_updates_async(session):
+                self.update_available.emit(self.update_info["version"], self.update_info["url"])
+                self.message_signal.emit("Загрузка обновления...")
+                await self.download_update_async(session)
+                self.ready = True
+                self.complete_signal.emit()
+            else:
+                self.message_signal.emit("У вас актуальная версия!")
 
     def run(self):
+        if self.ready:
+            return
+        self.cancelled = False
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
         try:
-            if loop.run_until_complete(self.check_updates_async()):
-                self.update_available.emit(self.update_info["version"], self.update_info["url"])
-                self.message_signal.emit("Загрузка обновления...")
-                loop.run_until_complete(self.download_update_async())
-                if self.verify_checksum():
-                    self.complete_signal.emit()
-                else:
-                    raise Exception("Ошибка проверки хеша")
-            else:
-                self.message_signal.emit("У вас актуальная версия!")
+            loop.run_until_complete(self.run_async())
         except Exception as e:
             self.message_signal.emit(f"Ошибка: {str(e)}")
         finally:
             loop.close()
 
 
-
 class UpdateDialog(QDialog):
-    def __init__(self, parent, version, url):
+    def __init__(self, parent, update_manager, version):
         super().__init__(parent)
         self.setWindowTitle(f"Обновление до v{version}")
         self.setFixedSize(500, 300)
@@ -239,38 +586,158 @@ class UpdateDialog(QDialog):
         main_layout = QVBoxLayout(self)
         main_layout.addWidget(self.container)
 
-        self.update_manager = UpdateManager()
+        # Загрузку ведёт общий UpdateManager окна - диалог только показывает её ход
+        self.update_manager = update_manager
         self.update_manager.progress_signal.connect(self.progress.setValue)
         self.update_manager.message_signal.connect(self.message.setText)
         self.update_manager.complete_signal.connect(self.on_complete)
-        self.update_manager.start()
+        self.progress.setValue(update_manager.progress)
+        if update_manager.ready:
+            self.on_complete()
+        elif not update_manager.isRunning():
+            update_manager.start()
 
     def on_complete(self):
+        self.progress.setValue(100)
         self.install_btn.setEnabled(True)
         self.message.setText("Обновление готово к установке!")
 
-    def closeEvent(self, event):
-        self.update_manager.cancelled = True
-        super().closeEvent(event)
+    def reject(self):
+        # Отмена прерывает загрузку; скачанное докачается при следующей проверке
+        if not self.update_manager.ready:
+            self.update_manager.cancelled = True
+        super().reject()
+
+    def done(self, result):
+        self.update_manager.progress_signal.disconnect(self.progress.setValue)
+        self.update_manager.message_signal.disconnect(self.message.setText)
+        self.update_manager.complete_signal.disconnect(self.on_complete)
+        super().done(result)
+
+
+class HistoryDialog(QDialog):
+    # Топы считаются в отдельном потоке: группировка по всей истории может занимать сотни мс
+    stats_ready = pyqtSignal(int, list, list)
+
+    def __init__(self, parent, store):
+        super().__init__(parent)
+        self.store = store
+        self.request = 0
+        self.setWindowTitle("История прослушиваний")
+        self.resize(700, 600)
+        self.setStyleSheet("""
+            QDialog {
+                background: qlineargradient(x1:0, y1:0, x2:1, y2:1,
+                    stop:0 #0f0c29, stop:1 #302b63);
+                color: #E0E0E0;
+            }
+            QLabel {
+                color: #ECF0F1;
+                font-weight: bold;
+            }
+            QListView, QListWidget, QComboBox {
+                background: rgba(30, 30, 47, 0.5);
+                border: 1px solid rgba(255, 255, 255, 0.1);
+                border-radius: 8px;
+                color: #B0B0B0;
+                padding: 4px;
+            }
+        """)
+
+        layout = QVBoxLayout(self)
+        self.period = QComboBox()
+        for title, seconds in HISTORY_PERIODS:
+            self.period.addItem(title, seconds)
+        self.period.currentIndexChanged.connect(self.refresh_stats)
+
+        tops = QHBoxLayout()
+        artists_layout = QVBoxLayout()
+        artists_layout.addWidget(QLabel("Исполнители"))
+        self.top_artists = QListWidget()
+        artists_layout.addWidget(self.top_artists)
+        tracks_layout = QVBoxLayout()
+        tracks_layout.addWidget(QLabel("Треки"))
+        self.top_tracks = QListWidget()
+        tracks_layout.addWidget(self.top_tracks)
+        tops.addLayout(artists_layout)
+        tops.addLayout(tracks_layout)
+
+        self.model = HistoryModel(store, self)
+        self.recent = QListView()
+        self.recent.setUniformItemSizes(True)
+        self.recent.setModel(self.model)
+
+        layout.addWidget(self.period)
+        layout.addLayout(tops, 2)
+        layout.addWidget(QLabel("Последние прослушивания"))
+        layout.addWidget(self.recent, 3)
+
+        self.stats_ready.connect(self.show_stats)
+        self.refresh_stats()
+
+    def refresh_stats(self):
+        self.request += 1
+        request = self.request
+        seconds = self.period.currentData()
+        since = time.time() - seconds if seconds else 0.0
+        self.top_artists.clear()
+        self.top_tracks.clear()
+
+        def query():
+            try:
+                self.stats_ready.emit(request, self.store.top_artists(since), self.store.top_tracks(since))
+            except Exception:
+                pass
+            finally:
+                self.store.release_reader()
+
+        threading.Thread(target=query, name="history-stats", daemon=True).start()
+
+    def show_stats(self, request, artists, tracks):
+        # Ответ на устаревший запрос (период уже сменили) отбрасывается
+        if request != self.request:
+            return
+        for artist, plays, listened in artists:
+            self.top_artists.addItem(f"{artist} - {plays} ({listened / 3600:.1f} ч)")
+        for artist, title, plays, listened in tracks:
+            self.top_tracks.addItem(f"{artist} - {title} - {plays}")
 
 
 class BridgeSignals(QObject):
     log_signal = pyqtSignal(str, str)
     status_signal = pyqtSignal(str)
-    update_rpc_signal = pyqtSignal(str, str)
+    update_rpc_signal = pyqtSignal(object, float)
+    rpc_event_signal = pyqtSignal(str, str)
+    cover_signal = pyqtSignal(str, QImage)
     notification_signal = pyqtSignal(str, str, str)
     show_tray_message_signal = pyqtSignal(str, str)
-    server_started = pyqtSignal()
+    server_started = pyqtSignal(int, float)
     server_stopped = pyqtSignal()
+    server_error = pyqtSignal(str)
     update_available = pyqtSignal(str, str)
 
 
     def __init__(self):
         super().__init__()
-        self.recognizer = sr.Recognizer()
-        self.microphone = sr.Microphone()
+        # Аудио-стек открывается только при первом обращении
+        self._recognizer = None
+        self._microphone = None
         self.running = True
 
+    @property
+    def recognizer(self):
+        if self._recognizer is None:
+            import speech_recognition as sr
+            self._recognizer = sr.Recognizer()
+        return self._recognizer
+
+    @property
+    def microphone(self):
+        if self._microphone is None:
+            import speech_recognition as sr
+            self._microphone = sr.Microphone()
+        return self._microphone
+
 
 
 
@@ -319,12 +786,22 @@ class VKDiscordBridge(QMainWindow):
         """)
         self.tray_menu.addAction("Открыть", self.show_normal)
         self.tray_menu.addAction("Настройки", self.show_settings)
+        self.tray_menu.addAction("История", self.show_history)
+        self.diagnostics_action = self.tray_menu.addAction("Диагностика", self.toggle_diagnostics)
+        self.diagnostics = None
+        self.diagnostics_timer = QTimer(self)
+        self.diagnostics_timer.setSingleShot(True)
+        self.diagnostics_timer.timeout.connect(self.finish_diagnostics)
         self.tray_menu.addSeparator()
         self.tray_menu.addAction("Выйти", QApplication.quit)
         self.tray_icon.setContextMenu(self.tray_menu)
         self.tray_icon.activated.connect(self.tray_activated)
         self.tray_icon.show()
 
+        # Настройки нужны до построения UI (ёмкость журнала, эффекты)
+        self.settings = SettingsStore()
+        apply_effects(self.settings["effects"])
+
         # Инициализация UI
         self.init_ui()
         self.signals = BridgeSignals()
@@ -334,26 +811,87 @@ class VKDiscordBridge(QMainWindow):
         self.signals.show_tray_message_signal.connect(self.show_tray_message)
         self.signals.server_started.connect(self.on_server_started)
         self.signals.server_stopped.connect(self.on_server_stopped)
+        self.signals.server_error.connect(self.on_server_error)
         self.signals.update_available.connect(self.show_update_dialog)
+        self.signals.rpc_event_signal.connect(self.on_rpc_event)
+        self.signals.cover_signal.connect(self.on_cover_loaded)
+
+        # Логи идут в общий конвейер: журнал в окне - лишь один из подписчиков
+        self.logger = LogPipeline(self.settings["log_levels"], RotatingJsonlWriter())
+        self.logger.subscribe(self.signals.log_signal.emit)
+        QApplication.instance().aboutToQuit.connect(self.logger.close)
+
+        self.metrics = Metrics()
+
+        # История и скробблинг: прослушивания пишутся и отправляются фоновыми потоками
+        self.history = HistoryStore()
+        self.scrobbler = Scrobbler(*(self.settings[key] for key in SCROBBLE_KEYS), on_event=self.on_scrobble_event)
+        if self.scrobbler.configured:
+            # Досылаем то, что осталось в очереди с прошлого запуска
+            self.scrobbler.start()
+        self.play_tracker = PlayTracker(self.on_play)
+        QApplication.instance().aboutToQuit.connect(self.finish_plays)
+
+        # Discord IPC работает в отдельном потоке, GUI только публикует активности
+        self.presence_worker = PresenceWorker(DISCORD_CLIENT_ID, self.signals.rpc_event_signal.emit,
+                                              metrics=self.metrics)
+        self.presence_worker.auto_reconnect = self.settings["auto_reconnect"]
+        self.presence_worker.start()
+        QApplication.instance().aboutToQuit.connect(self.presence_worker.stop)
 
         # Остальная инициализация
-        self.rpc = None
-        self.server_running = False
-        self.last_attempt_time = 0
-        self.auto_reconnect = True
-        self.current_song_data = None
-        self.reconnect_timer = QTimer()
-        self.reconnect_timer.timeout.connect(self.check_discord_connection)
+        self.sessions = SessionRegistry()
+        self.timeline_filter = TimelineFilter()
+        # Счётчики доставки update_rpc_signal: каждый пишет только свой поток
+        self.rpc_signals_emitted = 0
+        self.rpc_signals_delivered = 0
+        self.current_track = None
+        # Режим трея: пока окно скрыто, current_track - единственная модель представления,
+        # виджеты обновляются одним проходом при показе (render_track)
+        self.render_suspended = False
+        self.rendered_track = None
+        # Прогресс между событиями экстраполируется от снимка (позиция, длительность, пауза, время получения);
+        # один таймер, только пока окно видно и трек играет
+        self.track_received_at = 0.0
+        self.progress_timer = QTimer(self)
+        self.progress_timer.timeout.connect(self.tick_progress)
+        self.wakeups_mark = (time.monotonic(), process_context_switches())
+        self.cover_pixmaps = OrderedDict()
+        self.cover_fetcher = CoverFetcher(self._decode_cover)
+        QApplication.instance().aboutToQuit.connect(self.cover_fetcher.stop)
+        if UpdateInstaller().recover():
+            self.log_message("Прерванная установка обновления откачена", "WARNING")
         self.update_manager = UpdateManager()
         self.update_manager.message_signal.connect(self.log_message)
         self.update_manager.update_available.connect(self.signals.update_available.emit)
         QTimer.singleShot(3000, self.check_for_updates)
 
         # Для управления сервером
-        self.server_thread = None
-        self.loop = None
-        self.runner = None
-        self.site = None
+        self.server_port = self.settings["port"]
+        # Порт до неудачного перезапуска: к нему возвращаемся, когда новый не удалось занять
+        self.restart_from = None
+        self.revert_port = None
+        self.server = BridgeServer(self.handle_song_change,
+                                   on_started=self.signals.server_started.emit,
+                                   on_stopped=self.signals.server_stopped.emit,
+                                   on_error=self.signals.server_error.emit,
+                                   handle_disconnect=self.handle_disconnect,
+                                   metrics=self.metrics)
+        QApplication.instance().aboutToQuit.connect(self.server.stop)
+        self.settings.subscribe(self.apply_settings)
+        self.metrics.gauge("events_suppressed_total", lambda: {
+            'reason="timeline"': self.timeline_filter.suppressed,
+            'reason="session"': self.sessions.dropped
+        }, "counter")
+        self.metrics.gauge("discord_connected", lambda: self.presence_worker.connected)
+        self.metrics.gauge("socketio_clients", lambda: len(self.server.clients))
+        # Без метки sid: случайные идентификаторы сессий раздували бы число рядов
+        self.metrics.gauge("socketio_clients_with_rejections", lambda: len(self.server.rejections))
+        self.metrics.gauge("gui_signal_backlog", lambda: self.rpc_signals_emitted - self.rpc_signals_delivered)
+        self.metrics.gauge("history_plays_written_total", lambda: self.history.written, "counter")
+        self.metrics.gauge("scrobble_queue_length", lambda: self.scrobbler.pending)
+        self.metrics.gauge("scrobbles_submitted_total", lambda: self.scrobbler.submitted, "counter")
+        self.metrics.gauge("log_buffer_entries", lambda: self.log_model.count + len(self.log_model.pending))
 
 
     def load_fonts(self):
@@ -448,7 +986,7 @@ class VKDiscordBridge(QMainWindow):
         player_title.setStyleSheet("color: #ECF0F1;")
 
         self.cover_label = QLabel()
-        self.cover_label.setFixedSize(250, 250)
+        self.cover_label.setFixedSize(COVER_SIZE, COVER_SIZE)
         self.cover_label.setAlignment(Qt.AlignCenter)
         self.cover_label.setStyleSheet("""
             QLabel {
@@ -461,6 +999,9 @@ class VKDiscordBridge(QMainWindow):
         self.cover_animation = QPropertyAnimation(self.cover_label, b"geometry")
         self.cover_animation.setDuration(1000)
         self.cover_animation.setEasingCurve(QEasingCurve.OutBack)
+        self.cover_animation.finished.connect(
+            lambda: self.cover_animation.setEndValue(self.cover_label.geometry().adjusted(10, 10, -10, -10))
+        )
 
         self.track_info = QLabel("Нет активного трека")
         self.track_info.setStyleSheet("color: #FFFFFF; font-size: 16px;")
@@ -468,7 +1009,7 @@ class VKDiscordBridge(QMainWindow):
         self.track_info.setWordWrap(True)
 
         self.progress = ModernProgressBar()
-        self.progress.setValue(50)
+        self.progress.setValue(0)
 
         player_layout.addWidget(player_title, alignment=Qt.AlignCenter)
         player_layout.addWidget(self.cover_label, alignment=Qt.AlignCenter)
@@ -582,22 +1123,23 @@ class VKDiscordBridge(QMainWindow):
         log_title.setFont(player_title_font)
         log_title.setStyleSheet("color: #ECF0F1; margin-bottom: 10px;")
 
-        self.log = QListWidget()
+        self.log_model = LogModel(self.settings["log_capacity"], parent=self)
+        self.log = QListView()
+        self.log.setModel(self.log_model)
+        self.log.setUniformItemSizes(True)
+        self.log_model.flushed.connect(self.log.scrollToBottom)
         self.log.setStyleSheet("""
-            QListWidget {
+            QListView {
                 background: rgba(30, 30, 47, 0.5);
                 border: 1px solid rgba(255, 255, 255, 0.1);
                 border-radius: 10px;
                 color: #B0B0B0;
                 font-size: 12px;
             }
-            QListWidget::item {
+            QListView::item {
                 padding: 8px 10px;
                 border-bottom: 1px solid rgba(255, 255, 255, 0.05);
             }
-            QListWidget::item:last {
-                border-bottom: none;
-            }
         """)
         self.log.setMinimumHeight(200)
 
@@ -625,8 +1167,12 @@ class VKDiscordBridge(QMainWindow):
         version_label = QLabel(f"Версия: {VERSION}")
         version_label.setStyleSheet("color: #7289DA;")
 
+        self.server_info_label = QLabel("")
+        self.server_info_label.setStyleSheet("color: #B0B0B0; margin-right: 15px;")
+
         status_layout.addWidget(self.status_label)
         status_layout.addStretch()
+        status_layout.addWidget(self.server_info_label)
         status_layout.addWidget(version_label)
 
         self.start_btn.clicked.connect(self.start_server)
@@ -650,18 +1196,19 @@ class VKDiscordBridge(QMainWindow):
             self.show_normal()
 
     def check_for_updates(self):
-        self.update_manager.start()
+        if not self.update_manager.isRunning():
+            self.update_manager.start()
 
     def show_update_dialog(self, version, url):
-        dialog = UpdateDialog(self, version, url)
+        dialog = UpdateDialog(self, self.update_manager, version)
         if dialog.exec_() == QDialog.Accepted:
             self.install_update()
 
     def install_update(self):
         try:
-            # Распаковка обновления
-            with zipfile.ZipFile("update.zip", 'r') as zip_ref:
-                zip_ref.extractall(".")
+            # Подмена файлов из .update/staging; при ошибке установщик сам откатывает изменения
+            count = UpdateInstaller().install()
+            self.log_message(f"Обновлено файлов: {count}", "SUCCESS")
 
             # Запуск нового экземпляра приложения
             subprocess.Popen([sys.executable, *sys.argv])
@@ -673,6 +1220,84 @@ class VKDiscordBridge(QMainWindow):
     def show_tray_message(self, title, message):
         self.tray_icon.showMessage(title, message, QIcon(resource_path("update_icon.png")), 5000)
 
+    def event(self, event):
+        # UpdateRequest перерисовывает все изменённые виджеты окна - это и есть время перерисовки
+        if stage_timers.enabled and event.type() == QEvent.UpdateRequest:
+            started = time.perf_counter()
+            result = super().event(event)
+            stage_timers.record("gui_repaint", time.perf_counter() - started)
+            return result
+        return super().event(event)
+
+    def toggle_diagnostics(self):
+        if self.diagnostics is None:
+            session = DiagnosticsSession()
+            try:
+                session.start()
+            except Exception as e:
+                session.cancel()
+                self.log_message(f"Не удалось запустить диагностику: {str(e)}", "ERROR")
+                return
+            self.diagnostics = session
+            self.diagnostics_action.setText("Остановить диагностику")
+            self.log_message(f"Диагностика запущена на {DIAGNOSTICS_DURATION} с", "INFO")
+            self.diagnostics_timer.start(DIAGNOSTICS_DURATION * 1000)
+        else:
+            self.finish_diagnostics()
+
+    def finish_diagnostics(self):
+        self.diagnostics_timer.stop()
+        session, self.diagnostics = self.diagnostics, None
+        if session is None:
+            return
+        self.diagnostics_action.setText("Диагностика")
+        try:
+            path = session.stop({
+                "Версия": VERSION,
+                "Журнал": f"{self.log_model.count} записей",
+                "Discord": "подключен" if self.presence_worker.connected else "не подключен"
+            })
+        except Exception as e:
+            self.log_message(f"Ошибка диагностики: {str(e)}", "ERROR")
+            return
+        self.log_message(f"Отчёт диагностики сохранён: {path}", "SUCCESS")
+        self.tray_icon.showMessage("VK RPC Bridge", f"Отчёт диагностики: {path}", QIcon(resource_path("icon.ico")),
+                                   5000)
+
+    def hideEvent(self, event):
+        super().hideEvent(event)
+        if not self.render_suspended:
+            self.render_suspended = True
+            self.cover_animation.stop()
+            self.progress_timer.stop()
+            self.log_model.set_suspended(True)
+            self.report_wakeups("в окне")
+
+    def showEvent(self, event):
+        # До первой отрисовки: виджеты получают последнее состояние, и окно перерисовывается один раз
+        if self.render_suspended:
+            self.render_suspended = False
+            self.report_wakeups("в трее")
+            self.render_track(self.current_track, animate=False)
+            self.log_model.set_suspended(False)
+        super().showEvent(event)
+
+    def report_wakeups(self, phase):
+        # Частота переключений контекста процесса за прошедший этап (окно показано / скрыто)
+        if self.wakeups_mark is None:
+            return
+        now, switches = time.monotonic(), process_context_switches()
+        if switches is None:
+            # Сообщаем один раз и больше не замеряем
+            self.wakeups_mark = None
+            self.log_message("Замер пробуждений недоступен: на Windows нужен модуль psutil", "INFO")
+            return
+        started, previous = self.wakeups_mark
+        self.wakeups_mark = (now, switches)
+        if switches is not None and previous is not None and now - started >= 1:
+            self.log_message(f"Пробуждений {phase}: {(switches - previous) / (now - started):.1f}/с "
+                             f"за {now - started:.0f} с", "INFO", wakeups_phase=phase)
+
     def closeEvent(self, event):
         event.ignore()
         self.hide()
@@ -680,206 +1305,239 @@ class VKDiscordBridge(QMainWindow):
                                    2000)
 
     def check_discord_connection(self):
-        if not self.rpc:
-            try:
-                self.rpc = Presence(DISCORD_CLIENT_ID)
-                self.rpc.connect()
-                self.log_message("Подключение к Discord RPC", "RPC")
-                self.reconnect_btn.setEnabled(True)
-            except DiscordNotFound:
-                self.rpc = None
-                self.log_message("Discord не найден", "WARNING")
-            except Exception as e:
-                self.rpc = None
-                self.log_message(f"Ошибка подключения: {str(e)}", "ERROR")
+        self.presence_worker.request_connect()
+
+    def on_rpc_event(self, kind, message):
+        self.log_message(message, RPC_EVENT_LEVELS.get(kind, "INFO"))
 
     async def handle_song_change(self, sid, data):
-        self.log_message(f"Получены данные: {data}", "RECV")
+        # Замеры этапов только в режиме диагностики
+        timing = stage_timers.enabled
+        if timing:
+            started = time.perf_counter()
+        if self.logger.enabled("RECV"):
+            self.log_message(f"Получены данные: {data}", "RECV", sid=sid)
         try:
-            if 'artist' in data and 'songName' in data:
-                self.current_song_data = data.copy()
-            if 'paused' in data and not ('artist' in data and 'songName' in data) and self.current_song_data:
-                data = self.current_song_data.copy()
-                data['paused'] = data.get('paused', False)
-            artist = data.get('artist')
-            song_name = data.get('songName')
-            album = data.get('album')
-            duration = data.get('duration', 0)
-            position = data.get('position', 0)
-            paused = data.get('paused', False)
-            if not artist or not song_name:
-                self.log_message("Неполные данные о треке", "WARNING")
-                self.signals.update_rpc_signal.emit(json.dumps({}), "")
+            if timing:
+                parse_started = time.perf_counter()
+            forward, state = self.sessions.feed(sid, data)
+            accepted = forward and self.timeline_filter.accept(state)
+            if timing:
+                stage_timers.record("parse", time.perf_counter() - parse_started)
+            if not forward:
                 return
-            track_data = {
-                "artist": artist,
-                "title": song_name,
-                "album": album,
-                "duration": duration,
-                "position": position,
-                "paused": paused
-            }
-            self.signals.update_rpc_signal.emit(json.dumps(track_data), "")
+            if state is None:
+                self.log_message("Неполные данные о треке", "WARNING")
+            else:
+                self.play_tracker.feed(state)
+            if accepted:
+                self.rpc_signals_emitted += 1
+                self.signals.update_rpc_signal.emit(state, time.perf_counter())
         except Exception as e:
             self.log_message(f"Ошибка обработки трека: {str(e)}", "ERROR")
-
-    def _update_rpc(self, json_data, _):
+        finally:
+            if timing:
+                stage_timers.record("ingest", time.perf_counter() - started)
+
+    async def handle_disconnect(self, sid):
+        forward, state = self.sessions.remove(sid)
+        if forward:
+            self.log_message(f"Источник {sid} отключился", "SERVER")
+            self.play_tracker.feed(state)
+            if self.timeline_filter.accept(state):
+                self.rpc_signals_emitted += 1
+                self.signals.update_rpc_signal.emit(state, time.perf_counter())
+
+    def _update_rpc(self, state, emitted_at):
+        self.rpc_signals_delivered += 1
+        if stage_timers.enabled:
+            stage_timers.record("signal", time.perf_counter() - emitted_at)
         try:
-            data = json.loads(json_data)
-            artist = data.get("artist", "")
-            title = data.get("title", "")
-            album = data.get("album", "")
-            duration = data.get("duration", 0)
-            position = data.get("position", 0)
-            paused = data.get("paused", False)
-            current_time = time.time()
-            if not self.rpc:
-                if self.auto_reconnect and (current_time - self.last_attempt_time) > 10:
-                    self.last_attempt_time = current_time
-                    self.check_discord_connection()
-                return
-            activity = {
-                "activity_type": 2,
-                "details": artist,
-                "state": title,
-                "buttons": btns,
-                "large_image": "embedded_cover",
-                "large_text": "VK Music",
-                "small_image": "vk_logo",
-                "small_text": "Слушает в VK"
-            }
-            if paused:
-                activity["small_image"] = "pause_icon"
-                activity["small_text"] = "Пауза"
-            if duration > 0 and position >= 0:
-                activity["timestamps"] = {
-                    "start": int(current_time - position),
-                    "end": int(current_time - position + duration)
-                }
-            if artist and title:
-                self.rpc.update(**activity)
-                status_text = f"{artist} - {title} {'(пауза)' if paused else ''}"
-                self.status_label.setText(f"Статус: {status_text}")
-                self.log_message(f"RPC обновлен: {status_text}", "SUCCESS")
-                self.track_info.setText(f"<b>{title}</b><br>{artist}<br>{album}")
-                self.progress.setValue(int(position / duration * 100) if duration > 0 else 0)
-
-                # Анимация обложки
-                self.cover_animation.stop()
-                self.cover_animation.setStartValue(self.cover_label.geometry())
-                self.cover_animation.setEndValue(self.cover_label.geometry().adjusted(-10, -10, 10, 10))
-                self.cover_animation.finished.connect(
-                    lambda: self.cover_animation.setEndValue(self.cover_label.geometry().adjusted(10, 10, -10, -10))
-                )
-                self.cover_animation.start()
-            else:
-                self.rpc.clear()
-                self.status_label.setText("Статус: Не активно")
-                self.log_message("RPC статус очищен", "INFO")
-        except DiscordNotFound:
-            self.log_message("Discord не найден! Переподключитесь", "ERROR")
-            self.rpc = None
+            previous, self.current_track = self.current_track, state
+            if state is None:
+                self.presence_worker.post(None)
+            elif state != previous:
+                self.track_received_at = emitted_at
+                self.presence_worker.post(build_activity(state, btns))
+                if self.render_suspended and self.settings["notifications"] and not state.same_track(previous):
+                    self.tray_icon.showMessage(state.title, state.artist, QSystemTrayIcon.Information, 3000)
+            if not self.render_suspended:
+                self.render_track(state)
         except Exception as e:
             self.log_message(f"RPC ошибка: {str(e)}", "ERROR")
-            self.rpc = None
+
+    def render_track(self, state, animate=True):
+        previous, self.rendered_track = self.rendered_track, state
+        self.update_progress_timer()
+        if state is None:
+            self.status_label.setText("Статус: Не активно")
+            return
+        self.tick_progress()
+        if state == previous:
+            return
+        status_text = f"{state.artist} - {state.title} {'(пауза)' if state.paused else ''}"
+        self.status_label.setText(f"Статус: {status_text}")
+        if state.same_track(previous):
+            # Тот же трек: новая позиция или пауза, подписи не трогаем, обложку - только если сменилась
+            if state.cover != previous.cover:
+                self.show_cover(state.cover)
+            return
+        self.track_info.setText(f"<b>{state.title}</b><br>{state.artist}<br>{state.album}")
+        self.show_cover(state.cover)
+        if not animate:
+            return
+
+        # Анимация обложки
+        self.cover_animation.stop()
+        self.cover_animation.setStartValue(self.cover_label.geometry())
+        self.cover_animation.setEndValue(self.cover_label.geometry().adjusted(-10, -10, 10, 10))
+        self.cover_animation.start()
+
+    def update_progress_timer(self):
+        state = self.rendered_track
+        if self.render_suspended or state is None or state.paused or state.duration <= 0:
+            self.progress_timer.stop()
+            return
+        # Тик раз в процент длительности: каждое срабатывание сдвигает полосу, лишних перерисовок нет
+        self.progress_timer.start(min(PROGRESS_MAX_INTERVAL, max(PROGRESS_MIN_INTERVAL, int(state.duration * 10))))
+
+    def tick_progress(self):
+        state = self.rendered_track
+        if state is None:
+            return
+        position = extrapolate_position(state, self.track_received_at, time.perf_counter())
+        self.progress.setValue(int(position / state.duration * 100) if state.duration > 0 else 0)
+        if position >= state.duration:
+            self.progress_timer.stop()
+
+    def show_cover(self, url):
+        pixmap = self.cover_pixmaps.get(url) if url else None
+        if pixmap is not None:
+            self.cover_pixmaps.move_to_end(url)
+            self.cover_label.setPixmap(pixmap)
+            return
+        self.cover_label.setPixmap(QPixmap())
+        if url:
+            self.cover_fetcher.request(url)
+
+    def _decode_cover(self, url, data):
+        # Вызывается в потоке загрузчика: декодирование и масштабирование не трогают GUI
+        image = QImage.fromData(data)
+        if image.isNull():
+            return
+        image = image.scaled(COVER_SIZE, COVER_SIZE, Qt.KeepAspectRatioByExpanding, Qt.SmoothTransformation)
+        image = image.copy((image.width() - COVER_SIZE) // 2, (image.height() - COVER_SIZE) // 2,
+                           COVER_SIZE, COVER_SIZE)
+        self.signals.cover_signal.emit(url, image)
+
+    def on_cover_loaded(self, url, image):
+        self.cover_pixmaps[url] = QPixmap.fromImage(image)
+        self.cover_pixmaps.move_to_end(url)
+        while len(self.cover_pixmaps) > COVER_LRU_SIZE:
+            self.cover_pixmaps.popitem(last=False)
+        # В трее обложка только кешируется - render_track возьмёт её из кеша при показе
+        if not self.render_suspended and self.rendered_track is not None and self.rendered_track.cover == url:
+            self.cover_label.setPixmap(self.cover_pixmaps[url])
 
     def start_server(self):
-        if self.server_running:
+        if self.server.thread is not None:
             self.log_message("Сервер уже запущен", "WARNING")
             return
         self.start_btn.setEnabled(False)
         self.log_message("Запуск сервера...", "SERVER")
-        self.server_thread = threading.Thread(target=self.run_server, daemon=True)
-        self.server_thread.start()
-
-    def run_server(self):
-        try:
-            self.loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(self.loop)
-            sio = AsyncServer(async_mode='aiohttp', cors_allowed_origins='*', engineio_logger=False,
-                              allow_upgrades=True, ping_timeout=20, max_http_buffer_size=1e8)
-            app = web.Application()
-            sio.attach(app)
-
-            @sio.on('song_changed')
-            async def on_song_changed(sid, data):
-                await self.handle_song_change(sid, data)
-
-            @sio.on('song_paused')
-            async def on_song_paused(sid, data):
-                await self.handle_song_change(sid, {'paused': True})
-
-            runner = web.AppRunner(app)
-            self.loop.run_until_complete(runner.setup())
-            site = web.TCPSite(runner, port=8112)
-            self.loop.run_until_complete(site.start())
-            self.server_running = True
-            self.signals.server_started.emit()
-            self.log_message("Сервер запущен на порту 8112", "SUCCESS")
-            self.loop.run_forever()
-        except Exception as e:
-            self.log_message(f"Ошибка сервера: {str(e)}", "ERROR")
-            self.server_running = False
-            self.signals.server_stopped.emit()
+        self.server.start(self.server_port)
 
     def stop_server(self):
-        if not self.server_running:
+        if self.server.thread is None:
             return
+        self.stop_btn.setEnabled(False)
         self.log_message("Остановка сервера...", "SERVER")
-        if self.loop and self.loop.is_running():
-            self.loop.call_soon_threadsafe(self.loop.stop)
-            self.log_message("Цикл событий остановлен", "INFO")
-        self.server_running = False
-        self.signals.server_stopped.emit()
+        self.server.stop(wait=False)
 
-    def on_server_started(self):
+    def restart_server(self, port):
+        # Смена порта без перезапуска приложения: сервер пересоздаёт только сокет
+        previous, self.server_port = self.server_port, port
+        if self.server.thread is None:
+            return
+        self.restart_from = previous
+        self.log_message(f"Перезапуск сервера на порту {port}...", "SERVER")
+        self.server.restart(port)
+
+    def apply_settings(self, changed):
+        # Применяются только изменившиеся настройки: смена порта трогает лишь сокет сервера,
+        # остальное - атрибуты работающих компонентов
+        if "port" in changed:
+            self.restart_server(changed["port"])
+        if "auto_reconnect" in changed:
+            self.presence_worker.set_auto_reconnect(changed["auto_reconnect"])
+        if "log_capacity" in changed:
+            self.log_model.set_capacity(changed["log_capacity"])
+        if "effects" in changed:
+            apply_effects(changed["effects"])
+        if "log_levels" in changed:
+            for level in LOG_LEVELS:
+                self.logger.set_level(level, level in changed["log_levels"])
+        if any(key in changed for key in SCROBBLE_KEYS):
+            self.scrobbler.configure(*(self.settings[key] for key in SCROBBLE_KEYS))
+        self.log_message(f"Настройки применены: {', '.join(changed)}", "SUCCESS")
+
+    def on_server_error(self, message):
+        self.log_message(f"Ошибка сервера: {message}", "ERROR")
+        # Новый порт не занят - сервер остановится, и в on_server_stopped вернётся прежний порт
+        self.revert_port, self.restart_from = self.restart_from, None
+
+    def on_server_started(self, port, ready_ms):
+        self.restart_from = None
         self.start_btn.setEnabled(False)
         self.stop_btn.setEnabled(True)
-        self.status_label.setText("Статус: Сервер запущен")
+        self.status_label.setText(f"Статус: Сервер запущен на порту {port}")
+        self.server_info_label.setText(f"Порт {port} · готов за {ready_ms:.0f} мс")
+        self.log_message(f"Сервер запущен на порту {port} за {ready_ms:.0f} мс", "SUCCESS", ready_ms=ready_ms)
 
     def on_server_stopped(self):
         self.start_btn.setEnabled(True)
         self.stop_btn.setEnabled(False)
         self.status_label.setText("Статус: Сервер остановлен")
+        self.server_info_label.setText("")
+        if self.revert_port is not None:
+            port, self.revert_port = self.revert_port, None
+            self.log_message(f"Порт {self.server_port} недоступен, возвращён порт {port}", "WARNING")
+            try:
+                self.settings.update(port=port)
+            except OSError as e:
+                self.log_message(f"Не удалось сохранить настройки: {str(e)}", "ERROR")
+            self.start_server()
 
     def _log_message(self, message, level="INFO"):
-        color = {
-            "INFO": "#66b3ff",
-            "SUCCESS": "#4CAF50",
-            "WARNING": "#FFA500",
-            "ERROR": "#ff4444",
-            "RPC": "#9c27b0",
-            "SERVER": "#FF9800",
-            "RECV": "#9C27B0"
-        }.get(level, "#ffffff")
-        timestamp = datetime.now().strftime("%H:%M:%S.%f")[:-3]
-        item = QListWidgetItem(f"[{timestamp}] [{level}] {message}")
-        item.setForeground(QColor(color))
-
-        # Добавляем иконку в зависимости от уровня
-        icon_map = {
-            "INFO": "info.svg",
-            "SUCCESS": "success.svg",
-            "WARNING": "warning.svg",
-            "ERROR": "error.svg",
-            "RPC": "rpc.svg",
-            "SERVER": "server.svg",
-            "RECV": "receive.svg"
-        }
-        if level in icon_map:
-            item.setIcon(QIcon(resource_path(icon_map[level])))
+        self.log_model.append(message, level)
 
-        self.log.addItem(item)
-        self.log.scrollToBottom()
+    def log_message(self, message, level="INFO", **fields):
+        self.logger.log(message, level, **fields)
 
-    def log_message(self, message, level="INFO"):
-        self.signals.log_signal.emit(message, level)
+    def show_history(self):
+        dialog = HistoryDialog(self, self.history)
+        dialog.setAttribute(Qt.WA_DeleteOnClose)
+        dialog.exec_()
+
+    def on_play(self, play):
+        # Вызывается в потоке сервера: обе операции только ставят запись в очередь
+        self.history.add(play)
+        self.scrobbler.add(play)
+
+    def on_scrobble_event(self, kind, message):
+        self.log_message(message, SCROBBLE_EVENT_LEVELS.get(kind, "INFO"))
+
+    def finish_plays(self):
+        # Незавершённое прослушивание тоже попадает в историю и очередь скробблинга
+        self.play_tracker.finish()
+        self.history.close()
+        self.scrobbler.stop()
 
     def show_settings(self):
         # Реализация окна настроек
         settings_dialog = QDialog(self)
         settings_dialog.setWindowTitle("Настройки")
-        settings_dialog.setFixedSize(500, 400)
+        settings_dialog.setFixedSize(500, 800)
         settings_dialog.setStyleSheet("""
             QDialog {
                 background: qlineargradient(x1:0, y1:0, x2:1, y2:1,
@@ -906,11 +1564,10 @@ class VKDiscordBridge(QMainWindow):
         rpc_layout = QVBoxLayout()
 
         auto_reconnect = QCheckBox("Автоматическое переподключение к Discord")
-        auto_reconnect.setChecked(self.auto_reconnect)
-        auto_reconnect.stateChanged.connect(lambda state: setattr(self, 'auto_reconnect', bool(state)))
+        auto_reconnect.setChecked(self.settings["auto_reconnect"])
 
         show_notifications = QCheckBox("Показывать уведомления о треках")
-        show_notifications.setChecked(True)
+        show_notifications.setChecked(self.settings["notifications"])
 
         rpc_layout.addWidget(auto_reconnect)
         rpc_layout.addWidget(show_notifications)
@@ -921,7 +1578,7 @@ class VKDiscordBridge(QMainWindow):
         server_group.setStyleSheet(rpc_group.styleSheet())
         server_layout = QVBoxLayout()
 
-        port_input = QLineEdit("8112")
+        port_input = QLineEdit(str(self.server_port))
         port_input.setStyleSheet("""
             QLineEdit {
                 background: rgba(30, 30, 47, 0.5);
@@ -932,12 +1589,51 @@ class VKDiscordBridge(QMainWindow):
             }
         """)
 
+        log_capacity = QSpinBox()
+        log_capacity.setRange(*LIMITS["log_capacity"])
+        log_capacity.setSingleStep(500)
+        log_capacity.setValue(self.settings["log_capacity"])
+        log_capacity.setStyleSheet(port_input.styleSheet().replace("QLineEdit", "QSpinBox"))
+
         server_layout.addWidget(QLabel("Порт сервера:"))
         server_layout.addWidget(port_input)
+        server_layout.addWidget(QLabel("Строк в журнале:"))
+        server_layout.addWidget(log_capacity)
+
+        effects = QCheckBox("Тени и анимации интерфейса")
+        effects.setChecked(self.settings["effects"])
+        server_layout.addWidget(effects)
+
+        # Уровни журнала: RECV - полный дамп каждого полученного события
+        server_layout.addWidget(QLabel("Уровни журнала:"))
+        level_boxes = {}
+        for row in (LOG_LEVELS[:4], LOG_LEVELS[4:]):
+            row_layout = QHBoxLayout()
+            for level in row:
+                box = level_boxes[level] = QCheckBox(level)
+                box.setChecked(level in self.settings["log_levels"])
+                row_layout.addWidget(box)
+            row_layout.addStretch()
+            server_layout.addLayout(row_layout)
         server_group.setLayout(server_layout)
 
+        # Группа скробблинга: включается, когда заданы ключ, секрет и ключ сессии
+        scrobble_group = QGroupBox("Скробблинг (Last.fm)")
+        scrobble_group.setStyleSheet(rpc_group.styleSheet())
+        scrobble_layout = QFormLayout()
+        scrobble_inputs = {}
+        for key, label in (("scrobble_url", "Адрес API:"), ("scrobble_api_key", "API key:"),
+                           ("scrobble_api_secret", "Secret:"), ("scrobble_session_key", "Session key:")):
+            field = scrobble_inputs[key] = QLineEdit(self.settings[key])
+            field.setStyleSheet(port_input.styleSheet())
+            if key != "scrobble_url":
+                field.setEchoMode(QLineEdit.Password)
+            scrobble_layout.addRow(QLabel(label), field)
+        scrobble_group.setLayout(scrobble_layout)
+
         layout.addWidget(rpc_group)
         layout.addWidget(server_group)
+        layout.addWidget(scrobble_group)
         layout.addStretch()
 
         # Кнопки
@@ -978,7 +1674,29 @@ class VKDiscordBridge(QMainWindow):
 
         layout.addLayout(btn_layout)
         settings_dialog.setLayout(layout)
-        settings_dialog.exec_()
+        if settings_dialog.exec_() == QDialog.Accepted:
+            try:
+                port = int(port_input.text())
+            except ValueError:
+                port = 0
+            low, high = LIMITS["port"]
+            if not low <= port <= high:
+                self.log_message(f"Некорректный порт: {port_input.text()}", "WARNING")
+                port = self.settings["port"]
+            scrobble = {key: field.text().strip() for key, field in scrobble_inputs.items()}
+            if not scrobble["scrobble_url"].startswith(("http://", "https://")):
+                self.log_message(f"Некорректный адрес API скробблинга: {scrobble['scrobble_url']}", "WARNING")
+                scrobble["scrobble_url"] = self.settings["scrobble_url"]
+            try:
+                self.settings.update(port=port,
+                                     auto_reconnect=auto_reconnect.isChecked(),
+                                     notifications=show_notifications.isChecked(),
+                                     log_capacity=log_capacity.value(),
+                                     effects=effects.isChecked(),
+                                     log_levels=[level for level, box in level_boxes.items() if box.isChecked()],
+                                     **scrobble)
+            except OSError as e:
+                self.log_message(f"Не удалось сохранить настройки: {str(e)}", "ERROR")
 
 
 if __name__ == "__main__":
@@ -999,5 +1717,6 @@ if __name__ == "__main__":
 
     window = VKDiscordBridge()
     window.show()
-    window.reconnect_timer.start(10000)
+    startup_report.mark("окно")
+    window.log_message(f"Время запуска: {startup_report.summary()}", "INFO", startup=dict(startup_report.stages))
     sys.exit(app.exec_())
\ No newline at end of file
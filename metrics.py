@@ -0,0 +1,189 @@
+import bisect
+import os
+import sys
+import time
+
+METRICS_PREFIX = "vkrpc_"
+RPC_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def process_rss():
+    # Текущий RSS процесса в байтах без psutil (Linux и Windows); None на остальных платформах
+    try:
+        if sys.platform.startswith("linux"):
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        if sys.platform == "win32":
+            import ctypes
+            from ctypes import wintypes
+
+            class ProcessMemoryCounters(ctypes.Structure):
+                _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                            ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                            ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                            ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                            ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                            ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+
+            counters = ProcessMemoryCounters()
+            counters.cb = ctypes.sizeof(counters)
+            handle = ctypes.windll.kernel32.GetCurrentProcess()
+            if ctypes.windll.psapi.GetProcessMemoryInfo(handle, ctypes.byref(counters), counters.cb):
+                return counters.WorkingSetSize
+        # На остальных POSIX есть только ru_maxrss - пик, а не текущее значение (и в КиБ на BSD),
+        # поэтому метрика не выдаётся
+        return None
+    except Exception:
+        return None
+
+
+def process_context_switches():
+    # Переключения контекста всех потоков процесса (≈ пробуждения); None, если недоступно.
+    # На POSIX - getrusage, на Windows (нет модуля resource) - psutil, если он установлен
+    try:
+        import resource
+    except ImportError:
+        pass
+    else:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return usage.ru_nvcsw + usage.ru_nivcsw
+    try:
+        import psutil
+        return sum(psutil.Process().num_ctx_switches())
+    except Exception:
+        return None
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    # Счётчики дешёвые (инкремент в dict/int), всё остальное считается только при запросе /metrics.
+    # Источники из других частей приложения регистрируются как gauge(name, getter).
+
+    def __init__(self):
+        self.started = time.time()
+        self.events = {}
+        self.rejected = {}
+        # Клиенты, отключённые за слишком много некорректных событий
+        self.kicked = 0
+        self.rpc_latency = Histogram(RPC_LATENCY_BUCKETS)
+        self.rpc_errors = 0
+        self.reconnects = 0
+        self.gauges = []
+
+    def inc_event(self, kind):
+        self.events[kind] = self.events.get(kind, 0) + 1
+
+    def reject(self, reason):
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+
+    def kick(self):
+        self.kicked += 1
+
+    def observe_rpc(self, seconds):
+        self.rpc_latency.observe(seconds)
+
+    def gauge(self, name, getter, kind="gauge", help_text=""):
+        # getter возвращает число или dict {метки: число}, например {'reason="timeline"': 3}
+        self.gauges.append((name, getter, kind, help_text))
+
+    def _collect(self):
+        values = {}
+        for name, getter, kind, help_text in self.gauges:
+            try:
+                values[name] = (getter(), kind, help_text)
+            except Exception:
+                continue
+        return values
+
+    def render(self):
+        lines = []
+
+        def family(name, kind, help_text, samples):
+            full = METRICS_PREFIX + name
+            if help_text:
+                lines.append(f"# HELP {full} {help_text}")
+            lines.append(f"# TYPE {full} {kind}")
+            for labels, value in samples:
+                lines.append(f"{full}{{{labels}}} {value}" if labels else f"{full} {value}")
+
+        family("events_received_total", "counter", "Полученные события socket.io по типу",
+               [(f'type="{kind}"', count) for kind, count in sorted(self.events.items())])
+        family("events_rejected_total", "counter", "События, не прошедшие проверку схемы, по причине",
+               [(f'reason="{reason}"', count) for reason, count in sorted(self.rejected.items())])
+        family("clients_kicked_total", "counter", "Клиенты, отключённые за некорректные события",
+               [("", self.kicked)])
+        histogram = self.rpc_latency
+        samples = []
+        cumulative = 0
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            cumulative += count
+            samples.append((f'le="{bound}"', cumulative))
+        samples.append(('le="+Inf"', histogram.count))
+        lines.append(f"# TYPE {METRICS_PREFIX}rpc_update_seconds histogram")
+        lines.extend(f"{METRICS_PREFIX}rpc_update_seconds_bucket{{{labels}}} {value}" for labels, value in samples)
+        lines.append(f"{METRICS_PREFIX}rpc_update_seconds_sum {histogram.sum:.6f}")
+        lines.append(f"{METRICS_PREFIX}rpc_update_seconds_count {histogram.count}")
+        family("rpc_errors_total", "counter", "", [("", self.rpc_errors)])
+        family("discord_reconnects_total", "counter", "", [("", self.reconnects)])
+        for name, (value, kind, help_text) in self._collect().items():
+            if value is None:
+                continue
+            if isinstance(value, dict):
+                family(name, kind, help_text, sorted(value.items()))
+            else:
+                family(name, kind, help_text, [("", int(value) if isinstance(value, bool) else value)])
+        switches = process_context_switches()
+        if switches is not None:
+            lines.append(f"# TYPE {METRICS_PREFIX}process_context_switches_total counter")
+            lines.append(f"{METRICS_PREFIX}process_context_switches_total {switches}")
+        rss = process_rss()
+        if rss is not None:
+            lines.append("# TYPE process_resident_memory_bytes gauge")
+            lines.append(f"process_resident_memory_bytes {rss}")
+        return "\n".join(lines) + "\n"
+
+    def health(self):
+        report = {
+            "status": "ok",
+            "uptime": round(time.time() - self.started, 1),
+            "events": dict(self.events),
+            "rejected": dict(self.rejected),
+            "kicked": self.kicked,
+            "rpc_updates": self.rpc_latency.count,
+            "rpc_errors": self.rpc_errors,
+            "reconnects": self.reconnects,
+            "rss": process_rss()
+        }
+        for name, (value, kind, help_text) in self._collect().items():
+            if isinstance(value, dict):
+                # 'reason="timeline"' -> 'timeline'
+                value = {labels.split('"')[1]: count for labels, count in value.items()}
+            report[name] = value
+        return report
+
+
+def add_routes(app, metrics):
+    from aiohttp import web
+
+    async def handle_metrics(request):
+        return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8")
+
+    async def handle_health(request):
+        return web.json_response(metrics.health())
+
+    app.router.add_get("/metrics", handle_metrics)
+    app.router.add_get("/health", handle_health)
@@ -0,0 +1,359 @@
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+from diagnostics import stage_timers
+
+DISCORD_CLIENT_ID = '1381313733845975261'
+
+# Discord принимает примерно 5 обновлений статуса за 20 секунд
+PRESENCE_RATE = 5
+PRESENCE_PER = 20.0
+# Допуск при сравнении start/end: при повторной отправке того же трека они сдвигаются на секунду-две
+TIMESTAMP_TOLERANCE = 2
+TIMESTAMP_KEYS = ("start", "end")
+
+_NOTHING = object()
+
+# Уровень журнала для событий PresenceWorker
+RPC_EVENT_LEVELS = {
+    "connected": "RPC",
+    "not_found": "WARNING",
+    "error": "ERROR",
+    "updated": "SUCCESS",
+    "cleared": "INFO"
+}
+
+
+def same_activity(a, b):
+    if a is None or b is None:
+        return a is b
+    if a.keys() != b.keys():
+        return False
+    for key, value in a.items():
+        if key in TIMESTAMP_KEYS:
+            if abs(value - b[key]) > TIMESTAMP_TOLERANCE:
+                return False
+        elif value != b[key]:
+            return False
+    return True
+
+
+class PresenceScheduler:
+    # Планировщик между _update_rpc и pypresence:
+    # хранит только последнюю ожидающую активность (latest wins),
+    # пропускает повторы и тратит бюджет токенов по лимиту Discord.
+    # activity = None означает очистку статуса (rpc.clear()).
+
+    def __init__(self, rate=PRESENCE_RATE, per=PRESENCE_PER, clock=time.monotonic):
+        self.capacity = float(rate)
+        self.refill_rate = rate / per
+        self.clock = clock
+        self.tokens = self.capacity
+        self.updated_at = clock()
+        self.pending = _NOTHING
+        self.last_sent = _NOTHING
+        self.sent = 0
+        self.coalesced = 0
+        self.skipped = 0
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_rate)
+        self.updated_at = now
+
+    def has_pending(self):
+        return self.pending is not _NOTHING
+
+    def submit(self, activity):
+        if self.pending is not _NOTHING:
+            self.coalesced += 1
+        if self.last_sent is not _NOTHING and same_activity(activity, self.last_sent):
+            # Итоговое состояние уже показано в Discord
+            self.pending = _NOTHING
+            self.skipped += 1
+            return
+        self.pending = activity
+
+    def delay(self):
+        # None - отправлять нечего, 0 - можно отправить сейчас, иначе секунды до следующего токена
+        if self.pending is _NOTHING:
+            return None
+        self._refill()
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.refill_rate
+
+    def pop(self):
+        activity = self.pending
+        self.pending = _NOTHING
+        self._refill()
+        self.tokens = max(0.0, self.tokens - 1)
+        self.last_sent = activity
+        self.sent += 1
+        return activity
+
+    def invalidate(self):
+        # После ошибки отправки состояние Discord неизвестно - следующий submit не будет пропущен
+        if self.pending is _NOTHING and self.last_sent is not _NOTHING:
+            self.pending = self.last_sent
+        self.last_sent = _NOTHING
+
+
+# Переподключение: экспоненциальная задержка с разбросом, пока Discord закрыт
+RECONNECT_BASE = 2.0
+RECONNECT_MAX = 60.0
+RECONNECT_JITTER = 0.2
+CONNECT_TIMEOUT = 5.0
+# Как часто при подключении проверять, что сокет Discord ещё существует
+LIVENESS_INTERVAL = 15.0
+
+
+def discord_ipc_available():
+    # Дешёвая проверка без handshake: есть ли discord-ipc-N (те же пути, что ищет pypresence)
+    if sys.platform == "win32":
+        # Именованные каналы перечисляются из \\.\pipe\ - с завершающей чертой
+        paths = ("\\\\.\\pipe\\",)
+    else:
+        directory = os.environ.get("XDG_RUNTIME_DIR") or tempfile.gettempdir()
+        paths = tuple(os.path.join(directory, subdir) for subdir in
+                      (".", "snap.discord", "app/com.discordapp.Discord", "app/com.discordapp.DiscordCanary"))
+    for path in paths:
+        try:
+            with os.scandir(path) as entries:
+                if any(entry.name.startswith("discord-ipc-") for entry in entries):
+                    return True
+        except OSError:
+            continue
+    return False
+
+
+class Backoff:
+    def __init__(self, base=RECONNECT_BASE, maximum=RECONNECT_MAX, jitter=RECONNECT_JITTER, clock=time.monotonic):
+        self.base = base
+        self.maximum = maximum
+        self.jitter = jitter
+        self.clock = clock
+        self.failures = 0
+        self.next_at = 0.0
+
+    def remaining(self):
+        return max(0.0, self.next_at - self.clock())
+
+    def fail(self):
+        self.failures += 1
+        delay = min(self.maximum, self.base * 2 ** (self.failures - 1))
+        delay *= 1 + self.jitter * (2 * random.random() - 1)
+        self.next_at = self.clock() + delay
+        return delay
+
+    def reset(self):
+        self.failures = 0
+        self.next_at = 0.0
+
+
+class PresenceWorker:
+    # Вся работа с Discord IPC живёт в собственном цикле событий (AioPresence),
+    # GUI только отправляет активности через post() и получает события через on_event(kind, message).
+    # kind: connected, not_found, error, updated, cleared
+
+    def __init__(self, client_id, on_event=None, scheduler=None, metrics=None):
+        self.client_id = client_id
+        self.on_event = on_event or (lambda kind, message: None)
+        self.scheduler = scheduler or PresenceScheduler()
+        self.metrics = metrics
+        self.was_connected = False
+        self.auto_reconnect = True
+        self.rpc = None
+        self.loop = None
+        # Вызовы до запуска цикла воркера копятся здесь и выполняются в serve()
+        self.early_calls = []
+        self.lock = threading.Lock()
+        self.thread = None
+        self.running = False
+        self.connect_requested = False
+        self.backoff = Backoff()
+        self.next_probe = 0.0
+        self._wakeup = None
+
+    @property
+    def connected(self):
+        return self.rpc is not None
+
+    def start(self):
+        # Отдельный поток со своим циклом событий (GUI-режим)
+        self.thread = threading.Thread(target=self._run, name="presence-worker", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(self.serve())
+        finally:
+            loop.close()
+
+    def _call(self, callback, *args):
+        with self.lock:
+            if self.loop is None:
+                self.early_calls.append((callback, args))
+                return
+        if not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(callback, *args)
+
+    def post(self, activity):
+        self._call(self._submit, activity)
+
+    def request_connect(self):
+        self._call(self._request_connect)
+
+    def set_auto_reconnect(self, enabled):
+        # Через цикл воркера: без подключения он ждёт _wakeup без таймаута и иначе не заметит смену
+        self._call(self._set_auto_reconnect, enabled)
+
+    def stop(self):
+        self._call(self._stop)
+
+    def _wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _submit(self, activity):
+        self.scheduler.submit(activity)
+        self._wake()
+
+    def _set_auto_reconnect(self, enabled):
+        self.auto_reconnect = enabled
+        self._wake()
+
+    def _request_connect(self):
+        if self.rpc is None:
+            self.connect_requested = True
+            self._wake()
+
+    def _stop(self):
+        self.running = False
+        self._wake()
+
+    async def serve(self):
+        self._wakeup = asyncio.Event()
+        self.running = True
+        with self.lock:
+            self.loop = asyncio.get_running_loop()
+            early_calls, self.early_calls = self.early_calls, []
+        for callback, args in early_calls:
+            callback(*args)
+        try:
+            while self.running:
+                timeout = None
+                if self.rpc is None:
+                    if self.connect_requested or self.auto_reconnect:
+                        delay = 0 if self.connect_requested else self.backoff.remaining()
+                        if delay == 0:
+                            await self._connect()
+                            continue
+                        timeout = delay
+                else:
+                    delay = self.scheduler.delay()
+                    if delay == 0:
+                        await self._send(self.scheduler.pop())
+                        continue
+                    probe_in = self.next_probe - time.monotonic()
+                    if probe_in <= 0:
+                        if not discord_ipc_available():
+                            self._drop()
+                            self.on_event("not_found", "Discord закрыт")
+                            continue
+                        self.next_probe = time.monotonic() + LIVENESS_INTERVAL
+                        probe_in = LIVENESS_INTERVAL
+                    timeout = probe_in if delay is None else min(delay, probe_in)
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._drop()
+
+    def _connect_failed(self, manual, kind, message):
+        # Пишем в журнал только первую неудачу подряд и ручные попытки, а не каждую повторную
+        if manual or self.backoff.failures == 0:
+            self.on_event(kind, message)
+        self.backoff.fail()
+
+    async def _connect(self):
+        # pypresence импортируется в потоке воркера при первом подключении, а не при старте GUI
+        manual, self.connect_requested = self.connect_requested, False
+        if not discord_ipc_available():
+            self._connect_failed(manual, "not_found", "Discord не найден")
+            return
+        from pypresence import AioPresence, DiscordNotFound
+        rpc = AioPresence(self.client_id, loop=self.loop)
+        try:
+            await asyncio.wait_for(rpc.connect(), CONNECT_TIMEOUT)
+        except DiscordNotFound:
+            self._connect_failed(manual, "not_found", "Discord не найден")
+            return
+        except Exception as e:
+            self._connect_failed(manual, "error", f"Ошибка подключения: {str(e)}")
+            return
+        self.rpc = rpc
+        # Пауза переподключения сбрасывается только после успешной отправки (_send):
+        # успешный handshake ещё не значит, что Discord принимает наши данные
+        self.next_probe = time.monotonic() + LIVENESS_INTERVAL
+        if self.metrics is not None and self.was_connected:
+            self.metrics.reconnects += 1
+        self.was_connected = True
+        # Сразу возвращаем последний статус, если новее ничего не пришло
+        self.scheduler.invalidate()
+        self.on_event("connected", "Подключение к Discord RPC")
+
+    async def _send(self, activity):
+        from pypresence import ConnectionTimeout, DiscordNotFound, InvalidPipe, PipeClosed, ResponseTimeout
+        started = time.perf_counter()
+        try:
+            if activity is None:
+                await self.rpc.clear()
+            else:
+                await self.rpc.update(**activity)
+        except DiscordNotFound:
+            self.on_event("not_found", "Discord не найден! Переподключитесь")
+            self.scheduler.invalidate()
+            self._drop()
+        except (PipeClosed, InvalidPipe, ConnectionTimeout, ResponseTimeout, OSError, EOFError,
+                asyncio.TimeoutError) as e:
+            # Соединение потеряно: активность повторится после переподключения
+            self.on_event("error", f"RPC ошибка: {str(e) or type(e).__name__}")
+            self.scheduler.invalidate()
+            self._drop()
+        except Exception as e:
+            # Discord отверг сами данные (ServerError) или они не подходят pypresence (TypeError):
+            # соединение живо, повтор того же ничего не даст - активность отбрасывается.
+            # last_sent остаётся этой активностью, поэтому такие же повторы пропускаются планировщиком
+            self.on_event("error", f"Discord отклонил статус: {str(e) or type(e).__name__}")
+        else:
+            self.backoff.reset()
+            elapsed = time.perf_counter() - started
+            stage_timers.record("rpc_update", elapsed)
+            if self.metrics is not None:
+                self.metrics.observe_rpc(elapsed)
+            if activity is None:
+                self.on_event("cleared", "RPC статус очищен")
+            else:
+                self.on_event("updated", f"RPC обновлен: {activity['details']} - {activity['state']}")
+            return
+        if self.metrics is not None:
+            self.metrics.rpc_errors += 1
+
+    def _drop(self):
+        # Presence.close() в pypresence закрывает и цикл событий - нам нужен только сокет
+        rpc, self.rpc = self.rpc, None
+        if rpc is not None and getattr(rpc, "sock_writer", None) is not None:
+            try:
+                rpc.sock_writer.close()
+            except Exception:
+                pass
@@ -0,0 +1,248 @@
+import asyncio
+import hashlib
+import sqlite3
+import threading
+
+from presence import Backoff
+
+SCROBBLE_DB = "scrobbles.sqlite3"
+LASTFM_API_URL = "https://ws.audioscrobbler.com/2.0/"
+# Не больше 50 прослушиваний в одном track.scrobble (ограничение API)
+SCROBBLE_BATCH = 50
+SCROBBLE_TIMEOUT = 15
+SCROBBLE_RETRY_BASE = 30.0
+SCROBBLE_RETRY_MAX = 900.0
+# Правила Last.fm: трек длиннее 30 с, прослушан наполовину или 4 минуты.
+# Длительность 0 - неизвестна (хук из README её не присылает): тогда нужны полные 4 минуты
+SCROBBLE_MIN_DURATION = 30
+SCROBBLE_MAX_THRESHOLD = 240
+# Ошибки, которые относятся к самой пачке (6 invalid parameters, 7 invalid resource): повтор ничего не даст,
+# пачка удаляется. Всё остальное - сбои сети, HTML-страница портала, 5xx, 8/11/16/29 - повторяется с паузой
+BATCH_ERRORS = {6, 7}
+# Ошибки авторизации: очередь сохраняется до исправления ключей
+AUTH_ERRORS = {4, 9, 10, 13, 26}
+
+SCROBBLE_EVENT_LEVELS = {"submitted": "SUCCESS", "retry": "WARNING", "auth": "ERROR", "dropped": "ERROR"}
+
+
+class ScrobbleError(Exception):
+    def __init__(self, code, message):
+        super().__init__(f"{code}: {message}")
+        self.code = code
+
+
+def scrobble_eligible(play):
+    if not play.duration:
+        return play.listened >= SCROBBLE_MAX_THRESHOLD
+    return play.duration > SCROBBLE_MIN_DURATION and \
+        play.listened >= min(play.duration / 2, SCROBBLE_MAX_THRESHOLD)
+
+
+def api_signature(params, secret):
+    # api_sig: md5 от отсортированных пар ключ+значение и секрета (format не подписывается)
+    payload = "".join(key + str(params[key]) for key in sorted(params) if key not in ("format", "callback"))
+    return hashlib.md5((payload + secret).encode("utf-8")).hexdigest()
+
+
+class ScrobbleQueue:
+    # Очередь на диске (SQLite): прослушивание удаляется только после подтверждения сервером,
+    # поэтому переживает падение и работу без сети. Уникальность (исполнитель, трек, время) отсекает повторы
+
+    def __init__(self, path=SCROBBLE_DB):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        with self.connection:
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS scrobbles (
+                    id INTEGER PRIMARY KEY,
+                    artist TEXT NOT NULL,
+                    title TEXT NOT NULL,
+                    album TEXT NOT NULL DEFAULT '',
+                    timestamp INTEGER NOT NULL,
+                    duration INTEGER NOT NULL DEFAULT 0,
+                    UNIQUE (artist, title, timestamp)
+                )
+            """)
+
+    def push(self, play):
+        # True, если прослушивание новое
+        with self.connection:
+            cursor = self.connection.execute(
+                "INSERT OR IGNORE INTO scrobbles (artist, title, album, timestamp, duration) VALUES (?, ?, ?, ?, ?)",
+                (play.artist, play.title, play.album, int(play.started), int(play.duration)))
+        return cursor.rowcount > 0
+
+    def peek(self, limit=SCROBBLE_BATCH):
+        return self.connection.execute("SELECT id, artist, title, album, timestamp, duration FROM scrobbles"
+                                       " ORDER BY id LIMIT ?", (limit,)).fetchall()
+
+    def remove(self, ids):
+        with self.connection:
+            self.connection.executemany("DELETE FROM scrobbles WHERE id = ?", [(row_id,) for row_id in ids])
+
+    def count(self):
+        return self.connection.execute("SELECT COUNT(*) FROM scrobbles").fetchone()[0]
+
+    def close(self):
+        self.connection.close()
+
+
+class Scrobbler:
+    # Отправка прослушиваний в Last.fm-совместимый API из своего потока и цикла событий.
+    # add() вызывается из пути события и только передаёт прослушивание в поток;
+    # запись на диск и отправка пачками по SCROBBLE_BATCH - там же, с экспоненциальной паузой при ошибках.
+    # on_event(kind, message): submitted, retry, auth, dropped
+
+    def __init__(self, api_key, api_secret, session_key, base_url=LASTFM_API_URL, on_event=None,
+                 path=SCROBBLE_DB):
+        self.api_key = api_key
+        self.api_secret = api_secret
+        self.session_key = session_key
+        self.base_url = base_url
+        self.on_event = on_event or (lambda kind, message: None)
+        self.path = path
+        self.queue = None
+        self.backoff = Backoff(SCROBBLE_RETRY_BASE, SCROBBLE_RETRY_MAX)
+        self.loop = None
+        self.session = None
+        self.flush_task = None
+        self.submitted = 0
+        self.failed = 0
+        # Длина очереди на диске - для метрик из других потоков
+        self.pending = 0
+        self._ready = threading.Event()
+        self.thread = None
+
+    @property
+    def configured(self):
+        return bool(self.api_key and self.api_secret and self.session_key)
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="scrobbler", daemon=True)
+            self.thread.start()
+            self._ready.wait()
+
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.queue = ScrobbleQueue(self.path)
+        self.pending = self.queue.count()
+        self._ready.set()
+        # Оставшееся в очереди с прошлого запуска
+        self._wake()
+        self.loop.run_forever()
+        # Отправка прерывается: пачка остаётся в очереди до следующего запуска
+        if self.flush_task is not None and not self.flush_task.done():
+            self.flush_task.cancel()
+            self.loop.run_until_complete(asyncio.gather(self.flush_task, return_exceptions=True))
+        if self.session is not None:
+            self.loop.run_until_complete(self.session.close())
+        self.queue.close()
+        self.loop.close()
+
+    def stop(self, timeout=2.0):
+        if self.thread is None:
+            return
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout)
+
+    def configure(self, api_key, api_secret, session_key, base_url=LASTFM_API_URL):
+        # Новые ключи применяются на лету: пауза после ошибок сбрасывается, очередь отправляется заново
+        self.api_key = api_key
+        self.api_secret = api_secret
+        self.session_key = session_key
+        self.base_url = base_url
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._reconfigure)
+
+    def _reconfigure(self):
+        self.backoff.reset()
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+            self.flush_task = None
+        self._wake()
+
+    def add(self, play):
+        if not self.configured or not scrobble_eligible(play):
+            return False
+        self.start()
+        self.loop.call_soon_threadsafe(self._enqueue, play)
+        return True
+
+    def _enqueue(self, play):
+        if self.queue.push(play):
+            self.pending += 1
+            self._wake()
+
+    def _wake(self):
+        if self.configured and (self.flush_task is None or self.flush_task.done()):
+            self.flush_task = self.loop.create_task(self._flush())
+
+    async def _flush(self):
+        while True:
+            delay = self.backoff.remaining()
+            if delay:
+                await asyncio.sleep(delay)
+            batch = self.queue.peek(SCROBBLE_BATCH)
+            if not batch:
+                return
+            try:
+                accepted, ignored = await self._submit(batch)
+            except ScrobbleError as e:
+                if e.code in BATCH_ERRORS:
+                    self._remove(batch)
+                    self.failed += len(batch)
+                    self.on_event("dropped", f"Пачка из {len(batch)} прослушиваний отклонена: {e}")
+                elif e.code in AUTH_ERRORS:
+                    self._retry(str(e), kind="auth")
+                else:
+                    self._retry(str(e))
+                continue
+            except Exception as e:
+                self._retry(str(e) or type(e).__name__)
+                continue
+            self.backoff.reset()
+            self._remove(batch)
+            self.submitted += accepted
+            self.on_event("submitted", f"Отправлено прослушиваний: {accepted}, пропущено сервером: {ignored}")
+
+    def _remove(self, batch):
+        self.queue.remove([row[0] for row in batch])
+        self.pending = self.queue.count()
+
+    def _retry(self, reason, kind="retry"):
+        delay = self.backoff.fail()
+        self.on_event(kind, f"Скробблинг не удался ({reason}), повтор через {delay:.0f} с")
+
+    def request_params(self, batch):
+        params = {"method": "track.scrobble", "api_key": self.api_key, "sk": self.session_key}
+        for i, (row_id, artist, title, album, timestamp, duration) in enumerate(batch):
+            params[f"artist[{i}]"] = artist
+            params[f"track[{i}]"] = title
+            params[f"timestamp[{i}]"] = str(timestamp)
+            if album:
+                params[f"album[{i}]"] = album
+            if duration:
+                params[f"duration[{i}]"] = str(duration)
+        params["api_sig"] = api_signature(params, self.api_secret)
+        params["format"] = "json"
+        return params
+
+    async def _submit(self, batch):
+        # Возвращает (принято, пропущено сервером); ошибка API или непонятный ответ - ScrobbleError
+        # (код 0, если ответ не от API: не 200 или не JSON-объект)
+        from aiohttp import ClientSession, ClientTimeout
+        if self.session is None:
+            self.session = ClientSession(timeout=ClientTimeout(total=SCROBBLE_TIMEOUT))
+        async with self.session.post(self.base_url, data=self.request_params(batch)) as resp:
+            try:
+                data = await resp.json(content_type=None)
+            except ValueError:
+                data = None
+            if isinstance(data, dict) and "error" in data:
+                raise ScrobbleError(data["error"], data.get("message", ""))
+            if resp.status != 200 or not isinstance(data, dict):
+                raise ScrobbleError(0, f"HTTP {resp.status}")
+        attributes = data.get("scrobbles", {}).get("@attr", {})
+        return int(attributes.get("accepted", len(batch))), int(attributes.get("ignored", 0))
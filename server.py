@@ -0,0 +1,204 @@
+import asyncio
+import threading
+import time
+
+from metrics import add_routes
+from track import validate_song
+
+DEFAULT_PORT = 8112
+SHUTDOWN_TIMEOUT = 5.0
+# Предел одного сообщения engine.io: событие трека - сотни байт, больше не разбирается вовсе
+MAX_MESSAGE_BYTES = 16 * 1024
+# Клиент, приславший столько некорректных событий, отключается
+MAX_REJECTIONS = 50
+# Хук работает на страницах VK; клиенты без заголовка Origin (не браузер) допускаются socket.io всегда
+ALLOWED_ORIGINS = ["https://vk.com", "https://m.vk.com", "https://vk.ru", "https://m.vk.ru"]
+
+
+def create_app(handle_song_change, clients=None, handle_disconnect=None, metrics=None, rejections=None):
+    # Приложение aiohttp с socket.io: общее для окна и для фонового режима.
+    # clients - множество sid подключённых клиентов (для корректной остановки),
+    # metrics - счётчики событий и маршруты /metrics и /health,
+    # rejections - {sid: число отклонённых событий} для подключённых клиентов
+    from aiohttp import web
+    from socketio import AsyncServer
+    sio = AsyncServer(async_mode='aiohttp', cors_allowed_origins=ALLOWED_ORIGINS, engineio_logger=False,
+                      allow_upgrades=True, ping_timeout=20, max_http_buffer_size=MAX_MESSAGE_BYTES)
+    app = web.Application()
+    sio.attach(app)
+    if metrics is not None:
+        add_routes(app, metrics)
+        count = metrics.inc_event
+        reject = metrics.reject
+        kick = metrics.kick
+    else:
+        def count(kind):
+            pass
+
+        def reject(reason):
+            pass
+
+        def kick():
+            pass
+
+    if rejections is None:
+        rejections = {}
+
+    @sio.on('connect')
+    async def on_connect(sid, environ):
+        count('connect')
+        if clients is not None:
+            clients.add(sid)
+
+    @sio.on('disconnect')
+    async def on_disconnect(sid):
+        count('disconnect')
+        if clients is not None:
+            clients.discard(sid)
+        rejections.pop(sid, None)
+        if handle_disconnect is not None:
+            await handle_disconnect(sid)
+
+    @sio.on('song_changed')
+    async def on_song_changed(sid, data):
+        reason = validate_song(data)
+        if reason is not None:
+            reject(reason)
+            rejections[sid] = rejections.get(sid, 0) + 1
+            if rejections[sid] == MAX_REJECTIONS:
+                kick()
+                await sio.disconnect(sid)
+            return
+        count('song_changed')
+        await handle_song_change(sid, data)
+
+    @sio.on('song_paused')
+    async def on_song_paused(sid, data):
+        count('song_paused')
+        await handle_song_change(sid, {'paused': True})
+
+    return app, sio
+
+
+class BridgeServer:
+    # Жизненный цикл сервера: запуск, упорядоченная остановка и перезапуск на другом порту
+    # без пересоздания потока и цикла событий.
+    # on_started(port, ready_ms), on_stopped(), on_error(message) вызываются из потока сервера.
+
+    def __init__(self, handle_song_change, on_started=None, on_stopped=None, on_error=None, handle_disconnect=None,
+                 metrics=None):
+        self.handle_song_change = handle_song_change
+        self.handle_disconnect = handle_disconnect
+        self.metrics = metrics
+        self.on_started = on_started or (lambda port, ready_ms: None)
+        self.on_stopped = on_stopped or (lambda: None)
+        self.on_error = on_error or (lambda message: None)
+        self.clients = set()
+        self.rejections = {}
+        self.sio = None
+        self.runner = None
+        self.site = None
+        self.port = None
+        self.loop = None
+        self.thread = None
+
+    @property
+    def running(self):
+        return self.runner is not None
+
+    async def start_async(self, port=DEFAULT_PORT, host=None):
+        from aiohttp import web
+        app, self.sio = create_app(self.handle_song_change, self.clients, self.handle_disconnect, self.metrics,
+                                   self.rejections)
+        runner = web.AppRunner(app, shutdown_timeout=SHUTDOWN_TIMEOUT)
+        await runner.setup()
+        try:
+            site = web.TCPSite(runner, host=host, port=port)
+            await site.start()
+        except Exception:
+            await runner.cleanup()
+            self.sio = None
+            raise
+        self.runner, self.site, self.port = runner, site, port
+
+    async def stop_async(self):
+        if self.runner is None:
+            return
+        runner, sio = self.runner, self.sio
+        self.runner = self.site = self.sio = None
+        # Сначала перестаём принимать соединения, затем отключаем клиентов и освобождаем runner
+        try:
+            await self._stop_sites(runner)
+            for sid in list(self.clients):
+                try:
+                    await sio.disconnect(sid)
+                except Exception:
+                    pass
+        finally:
+            self.clients.clear()
+            self.rejections.clear()
+            await runner.cleanup()
+
+    @staticmethod
+    async def _stop_sites(runner):
+        for site in list(runner.sites):
+            await site.stop()
+
+    async def restart_async(self, port, host=None):
+        await self.stop_async()
+        await self.start_async(port, host)
+
+    # Режим отдельного потока (окно)
+
+    def start(self, port=DEFAULT_PORT):
+        if self.thread is not None:
+            return
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run, args=(port,), name="bridge-server", daemon=True)
+        self.thread.start()
+
+    def _run(self, port):
+        asyncio.set_event_loop(self.loop)
+        started = time.perf_counter()
+        try:
+            self.loop.run_until_complete(self.start_async(port))
+        except Exception as e:
+            self.on_error(str(e))
+        else:
+            self.on_started(port, (time.perf_counter() - started) * 1000)
+            self.loop.run_forever()
+        finally:
+            try:
+                self.loop.run_until_complete(self.stop_async())
+                self.loop.run_until_complete(self.loop.shutdown_asyncgens())
+            finally:
+                self.loop.close()
+                self.loop = None
+                self.thread = None
+                self.on_stopped()
+
+    def stop(self, wait=True):
+        loop, thread = self.loop, self.thread
+        if loop is None or thread is None:
+            return
+        loop.call_soon_threadsafe(loop.stop)
+        if wait and thread is not threading.current_thread():
+            thread.join(SHUTDOWN_TIMEOUT + 1)
+
+    def restart(self, port):
+        # Перезапуск на месте: тот же поток и цикл событий, меняется только сокет
+        loop = self.loop
+        if loop is None:
+            self.start(port)
+            return
+        loop.call_soon_threadsafe(lambda: loop.create_task(self._restart(port)))
+
+    async def _restart(self, port):
+        started = time.perf_counter()
+        try:
+            await self.restart_async(port)
+        except Exception as e:
+            self.on_error(str(e))
+            self.loop.stop()
+            return
+        self.on_started(port, (time.perf_counter() - started) * 1000)
@@ -0,0 +1,69 @@
+import time
+
+from track import TrackTracker
+
+# Источник без событий дольше этого времени считается устаревшим и теряет приоритет
+SESSION_STALE_AFTER = 600.0
+
+
+class Session:
+    __slots__ = ("sid", "tracker", "state", "last_seen")
+
+    def __init__(self, sid):
+        self.sid = sid
+        self.tracker = TrackTracker()
+        self.state = None
+        self.last_seen = 0.0
+
+    @property
+    def playing(self):
+        return self.state is not None and not self.state.paused
+
+
+class SessionRegistry:
+    # Несколько вкладок/хуков: у каждого sid своё последнее состояние, но в RPC попадает
+    # только один авторитетный источник.
+    # Правило: события авторитетного источника проходят всегда; другой источник перехватывает
+    # приоритет, если авторитетного нет, он устарел, отключился или стоит на паузе,
+    # а новый источник играет. Остальные события отбрасываются до RPC.
+
+    def __init__(self, stale_after=SESSION_STALE_AFTER, clock=time.monotonic):
+        self.stale_after = stale_after
+        self.clock = clock
+        self.sessions = {}
+        self.authority = None
+        self.dropped = 0
+
+    def _is_stale(self, session, now):
+        return now - session.last_seen > self.stale_after
+
+    def feed(self, sid, data):
+        # Возвращает (forward, state): forward=False - событие не должно дойти до RPC
+        now = self.clock()
+        session = self.sessions.get(sid)
+        if session is None:
+            session = self.sessions[sid] = Session(sid)
+        session.state = session.tracker.feed(data)
+        session.last_seen = now
+
+        current = self.sessions.get(self.authority)
+        if current is not None and current is not session:
+            if not self._is_stale(current, now) and (current.playing or not session.playing):
+                self.dropped += 1
+                return False, None
+        self.authority = sid
+        return True, session.state
+
+    def remove(self, sid):
+        # Возвращает (forward, state) для нового авторитетного источника, если он есть
+        session = self.sessions.pop(sid, None)
+        if session is None or sid != self.authority:
+            return False, None
+        self.authority = None
+        now = self.clock()
+        candidates = [s for s in self.sessions.values() if not self._is_stale(s, now)]
+        if not candidates:
+            return True, None
+        best = max(candidates, key=lambda s: (s.playing, s.last_seen))
+        self.authority = best.sid
+        return True, best.state
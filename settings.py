@@ -0,0 +1,95 @@
+import json
+import os
+
+from logsink import LOG_LEVELS
+from scrobbler import LASTFM_API_URL
+from server import DEFAULT_PORT
+
+SETTINGS_FILE = "settings.json"
+# Сколько последних записей хранит журнал событий
+LOG_CAPACITY = 5000
+
+# Допустимые диапазоны числовых настроек (включительно)
+LIMITS = {
+    "port": (1, 65535),
+    "log_capacity": (100, 100000)
+}
+
+DEFAULTS = {
+    "port": DEFAULT_PORT,
+    "auto_reconnect": True,
+    "notifications": True,
+    "log_capacity": LOG_CAPACITY,
+    "effects": True,
+    # Включённые уровни журнала; RECV (полный дамп каждого события) по умолчанию выключен
+    "log_levels": [level for level in LOG_LEVELS if level != "RECV"],
+    # Скробблинг включается, когда заданы все три ключа; scrobble_url - любой Last.fm-совместимый API
+    "scrobble_url": LASTFM_API_URL,
+    "scrobble_api_key": "",
+    "scrobble_api_secret": "",
+    "scrobble_session_key": ""
+}
+
+SCROBBLE_KEYS = ("scrobble_api_key", "scrobble_api_secret", "scrobble_session_key", "scrobble_url")
+
+
+def valid_setting(key, value):
+    if key not in DEFAULTS or type(value) is not type(DEFAULTS[key]):
+        return False
+    if key in LIMITS:
+        low, high = LIMITS[key]
+        return low <= value <= high
+    if key == "log_levels":
+        return all(level in LOG_LEVELS for level in value)
+    return True
+
+
+class SettingsStore:
+    # Настройки в одном небольшом JSON: читаются один раз при запуске, пишутся атомарно (tmp + os.replace).
+    # update() сохраняет только реально изменившиеся ключи и сообщает о них подписчикам,
+    # чтобы каждый компонент применял лишь своё
+
+    def __init__(self, path=SETTINGS_FILE, defaults=None):
+        self.path = path
+        self.values = dict(DEFAULTS if defaults is None else defaults)
+        self.subscribers = []
+        try:
+            with open(path, encoding="utf-8") as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            stored = {}
+        for key, value in stored.items():
+            # Неизвестные ключи, значения другого типа и вне диапазона (ручная правка файла) игнорируются
+            if key in self.values and valid_setting(key, value):
+                self.values[key] = value
+
+    def __getitem__(self, key):
+        return self.values[key]
+
+    def subscribe(self, callback):
+        # callback(changed) - changed: {ключ: новое значение}
+        self.subscribers.append(callback)
+
+    def update(self, **changes):
+        # Некорректное значение - ValueError до любых изменений.
+        # Изменения применяются и до подписчиков доходят даже при ошибке записи файла - OSError после них
+        for key, value in changes.items():
+            if not valid_setting(key, value):
+                raise ValueError(f"Некорректное значение настройки {key}: {value!r}")
+        changed = {key: value for key, value in changes.items() if self.values.get(key) != value}
+        if not changed:
+            return changed
+        self.values.update(changed)
+        for callback in self.subscribers:
+            callback(changed)
+        self.save()
+        return changed
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.values, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
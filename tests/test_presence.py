@@ -0,0 +1,131 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+import presence
+from benchmark import FakeDiscordIPC
+from metrics import Metrics
+
+
+class FakeEntries:
+    def __init__(self, names):
+        self.names = names
+
+    def __enter__(self):
+        return [type("Entry", (), {"name": name})() for name in self.names]
+
+    def __exit__(self, *exc):
+        return False
+
+
+def fake_scandir(listing, calls):
+    def scandir(path):
+        calls.append(path)
+        if path not in listing:
+            raise FileNotFoundError(path)
+        return FakeEntries(listing[path])
+    return scandir
+
+
+def test_windows_lists_pipe_namespace(monkeypatch):
+    calls = []
+    monkeypatch.setattr(presence.sys, "platform", "win32")
+    monkeypatch.setattr(presence.os, "scandir", fake_scandir({"\\\\.\\pipe\\": ["mojo.1", "discord-ipc-0"]}, calls))
+    assert presence.discord_ipc_available()
+    assert calls == ["\\\\.\\pipe\\"]
+
+
+def test_windows_without_discord_pipe(monkeypatch):
+    calls = []
+    monkeypatch.setattr(presence.sys, "platform", "win32")
+    monkeypatch.setattr(presence.os, "scandir", fake_scandir({"\\\\.\\pipe\\": ["mojo.1"]}, calls))
+    assert not presence.discord_ipc_available()
+
+
+def test_posix_checks_flatpak_directory(monkeypatch):
+    calls = []
+    runtime = os.path.join("run", "user", "1000")
+    flatpak = os.path.join(runtime, "app/com.discordapp.Discord")
+    monkeypatch.setattr(presence.sys, "platform", "linux")
+    monkeypatch.setenv("XDG_RUNTIME_DIR", runtime)
+    monkeypatch.setattr(presence.os, "scandir", fake_scandir({flatpak: ["discord-ipc-1"]}, calls))
+    assert presence.discord_ipc_available()
+    assert calls[-1] == flatpak
+    assert calls[0] == os.path.join(runtime, ".")
+
+
+def test_same_activity_tolerates_timestamp_drift():
+    activity = {"details": "Artist", "state": "Title", "start": 1000, "end": 1180}
+    assert presence.same_activity(activity, dict(activity, start=1001, end=1181))
+    assert not presence.same_activity(activity, dict(activity, start=1010, end=1190))
+
+
+class RejectingIPC(FakeDiscordIPC):
+    # Discord отвечает ERROR на каждый SET_ACTIVITY - как на state из одного символа
+    @staticmethod
+    def _send(writer, op, payload):
+        if payload.get("cmd") == "SET_ACTIVITY":
+            payload = dict(payload, evt="ERROR", data={"code": 4000, "message": "Invalid activity"})
+        FakeDiscordIPC._send(writer, op, payload)
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="Discord IPC через Unix-сокет")
+def test_rejected_activity_does_not_reconnect(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_RUNTIME_DIR", str(tmp_path))
+    events = []
+    metrics = Metrics()
+
+    async def run():
+        discord = RejectingIPC(str(tmp_path))
+        await discord.start()
+        worker = presence.PresenceWorker("1", lambda kind, message: events.append(kind), metrics=metrics)
+        task = asyncio.ensure_future(worker.serve())
+        try:
+            while not worker.connected:
+                await asyncio.sleep(0.01)
+            worker.post({"details": "Artist", "state": "T"})
+            await asyncio.sleep(0.5)
+            # Та же активность ещё раз - уже известно, что Discord её не примет
+            worker.post({"details": "Artist", "state": "T"})
+            await asyncio.sleep(0.5)
+            return worker.connected, len(discord.activities)
+        finally:
+            worker.stop()
+            await task
+            await discord.stop()
+
+    connected, sent = asyncio.run(run())
+    assert connected
+    assert sent == 1
+    assert events == ["connected", "error"]
+    assert metrics.reconnects == 0
+    assert metrics.rpc_errors == 1
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="Discord IPC через Unix-сокет")
+def test_enabling_auto_reconnect_wakes_idle_worker(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_RUNTIME_DIR", str(tmp_path))
+
+    async def run():
+        discord = FakeDiscordIPC(str(tmp_path))
+        await discord.start()
+        worker = presence.PresenceWorker("1", lambda kind, message: None)
+        worker.auto_reconnect = False
+        task = asyncio.ensure_future(worker.serve())
+        try:
+            await asyncio.sleep(0.2)
+            idle = worker.connected
+            worker.set_auto_reconnect(True)
+            for _ in range(100):
+                if worker.connected:
+                    break
+                await asyncio.sleep(0.01)
+            return idle, worker.connected
+        finally:
+            worker.stop()
+            await task
+            await discord.stop()
+
+    assert asyncio.run(run()) == (False, True)
@@ -0,0 +1,107 @@
+import asyncio
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from history import Play
+from scrobbler import ScrobbleQueue, Scrobbler, api_signature, scrobble_eligible
+
+
+def api_app(requests, respond):
+    # Локальная замена Last.fm: запоминает параметры запросов, ответ строит respond(params)
+    async def handler(request):
+        params = dict(await request.post())
+        requests.append(params)
+        return respond(params)
+
+    app = web.Application()
+    app.router.add_post("/2.0/", handler)
+    return app
+
+
+def flush(tmp_path, respond, plays=3, until=None):
+    # Прогоняет Scrobbler._flush против локального сервера; until(events) - когда прервать отправку
+    requests, events = [], []
+
+    async def run():
+        server = TestServer(api_app(requests, respond))
+        await server.start_server()
+        scrobbler = Scrobbler("key", "secret", "session", base_url=str(server.make_url("/2.0/")),
+                              on_event=lambda kind, message: events.append(kind), path=str(tmp_path / "q.sqlite3"))
+        scrobbler.queue = ScrobbleQueue(scrobbler.path)
+        for i in range(plays):
+            scrobbler.queue.push(Play(1700000000 + i * 300, "Artist", f"Track {i}", "", 200, 150))
+        try:
+            task = asyncio.ensure_future(scrobbler._flush())
+            while not task.done() and not (until and until(events)):
+                await asyncio.sleep(0.01)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            return scrobbler, scrobbler.queue.count()
+        finally:
+            if scrobbler.session is not None:
+                await scrobbler.session.close()
+            scrobbler.queue.close()
+            await server.close()
+
+    scrobbler, remaining = asyncio.run(run())
+    return scrobbler, remaining, requests, events
+
+
+def test_accepted_batch_is_removed(tmp_path):
+    def respond(params):
+        return web.json_response({"scrobbles": {"@attr": {"accepted": 3, "ignored": 0}}})
+
+    scrobbler, remaining, requests, events = flush(tmp_path, respond)
+    assert remaining == 0
+    assert events == ["submitted"]
+    assert scrobbler.submitted == 3
+    params = requests[0]
+    assert params["track[2]"] == "Track 2"
+    signed = {key: value for key, value in params.items() if key != "api_sig"}
+    assert params["api_sig"] == api_signature(signed, "secret")
+
+
+def test_batch_error_drops_only_that_batch(tmp_path):
+    def respond(params):
+        return web.json_response({"error": 6, "message": "Invalid parameters"})
+
+    scrobbler, remaining, requests, events = flush(tmp_path, respond)
+    assert remaining == 0
+    assert events == ["dropped"]
+    assert scrobbler.failed == 3
+    assert len(requests) == 1
+
+
+def test_html_page_keeps_queue_and_backs_off(tmp_path):
+    # Портал авторизации Wi-Fi или прокси отвечает 200 с HTML вместо API
+    def respond(params):
+        return web.Response(text="<html><body>Sign in to the network</body></html>", content_type="text/html")
+
+    scrobbler, remaining, requests, events = flush(tmp_path, respond, until=lambda events: events)
+    assert remaining == 3
+    assert events == ["retry"]
+    assert len(requests) == 1
+    assert scrobbler.backoff.remaining() > 0
+
+
+def test_server_error_keeps_queue(tmp_path):
+    def respond(params):
+        return web.Response(status=404, text="Not Found")
+
+    scrobbler, remaining, requests, events = flush(tmp_path, respond, until=lambda events: events)
+    assert remaining == 3
+    assert events == ["retry"]
+
+
+def test_unknown_duration_uses_listened_time():
+    # Хук из README не присылает длительность
+    assert scrobble_eligible(Play(0, "A", "T", "", 0, 900))
+    assert scrobble_eligible(Play(0, "A", "T", "", 0, 240))
+    assert not scrobble_eligible(Play(0, "A", "T", "", 0, 200))
+
+
+def test_known_duration_rules():
+    assert scrobble_eligible(Play(0, "A", "T", "", 200, 100))
+    assert not scrobble_eligible(Play(0, "A", "T", "", 200, 99))
+    assert not scrobble_eligible(Play(0, "A", "T", "", 25, 25))
@@ -0,0 +1,47 @@
+import inspect
+
+from pypresence import AioPresence
+
+from track import TrackState, TrackTracker, btns, build_activity, validate_song
+
+
+def test_hook_event_without_title_is_valid_but_incomplete():
+    # Хук для заголовка без "—" шлёт songName: undefined - в JSON поле просто пропадает
+    data = {"artist": "Artist", "source": "VK"}
+    assert validate_song(data) is None
+    assert TrackTracker().feed(data) is None
+
+
+def test_null_strings_are_treated_as_missing():
+    assert validate_song({"artist": "Artist", "songName": None, "album": None}) is None
+
+
+def test_malformed_events_are_rejected():
+    assert validate_song(["artist"]) == "not_object"
+    assert validate_song({"artist": "A", "songName": "T", "extra": 1}) == "unknown_field"
+    assert validate_song({"artist": 5, "songName": "T"}) == "bad_string"
+    assert validate_song({"artist": "A" * 257, "songName": "T"}) == "bad_string"
+    assert validate_song({"artist": "A", "songName": "T", "duration": True}) == "bad_number"
+    assert validate_song({"artist": "A", "songName": "T", "position": float("nan")}) == "bad_number"
+    assert validate_song({"artist": "A", "songName": "T", "paused": 1}) == "bad_type"
+
+
+def test_activity_matches_aio_presence_update():
+    state = TrackState("Artist", "Title", "Album", 180, 30, False, "https://example.com/cover.jpg")
+    activity = build_activity(state, btns, now=1000)
+    inspect.signature(AioPresence.update).bind(None, **activity)
+    assert (activity["start"], activity["end"]) == (970, 1150)
+
+
+def test_hook_spaces_are_stripped():
+    state = TrackTracker().feed({"artist": "Artist ", "songName": " Title", "source": "VK"})
+    assert (state.artist, state.title) == ("Artist", "Title")
+    assert TrackTracker().feed({"artist": "Artist", "songName": "   "}) is None
+
+
+def test_activity_text_fits_discord_limits():
+    state = TrackState("A", "T" * 300, None, 0, 0, False, "https://example.com/" + "c" * 300)
+    activity = build_activity(state, btns)
+    assert 2 <= len(activity["details"]) <= 128
+    assert len(activity["state"]) == 128
+    assert activity["large_image"] == "embedded_cover"
@@ -0,0 +1,113 @@
+import asyncio
+import hashlib
+import os
+
+import pytest
+from aiohttp import ClientSession, web
+from aiohttp.test_utils import TestServer
+
+from updater import UpdateDownloader, UpdateError, UpdateInstaller
+
+PAYLOAD = os.urandom(300 * 1024)
+PAYLOAD_SHA = hashlib.sha256(PAYLOAD).hexdigest()
+
+
+def release_app(requests, ranges=True):
+    # Локальная замена GitHub: отдаёт PAYLOAD, Range - только при ranges=True
+    async def handler(request):
+        requests.append(request.headers.get("Range"))
+        header = request.headers.get("Range")
+        if ranges and header:
+            start = int(header[len("bytes="):].rstrip("-"))
+            if start >= len(PAYLOAD):
+                return web.Response(status=416)
+            return web.Response(status=206, body=PAYLOAD[start:],
+                                headers={"Content-Range": f"bytes {start}-{len(PAYLOAD) - 1}/{len(PAYLOAD)}"})
+        return web.Response(body=PAYLOAD)
+
+    app = web.Application()
+    app.router.add_get("/update.zip", handler)
+    return app
+
+
+def download(app, downloader):
+    async def run():
+        server = TestServer(app)
+        await server.start_server()
+        try:
+            downloader.url = str(server.make_url("/update.zip"))
+            async with ClientSession() as session:
+                return await downloader.download(session)
+        finally:
+            await server.close()
+    return asyncio.run(run())
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_resumes_partial_download_with_range(tmp_path):
+    requests = []
+    path = str(tmp_path / "update.zip")
+    with open(path + ".part", "wb") as f:
+        f.write(PAYLOAD[:100 * 1024])
+    progress = []
+    downloader = UpdateDownloader(None, PAYLOAD_SHA, path, on_progress=lambda done, total: progress.append((done, total)))
+    assert download(release_app(requests), downloader) == path
+    assert requests == [f"bytes={100 * 1024}-"]
+    assert read(path) == PAYLOAD
+    assert not os.path.exists(path + ".part")
+    assert progress[-1] == (len(PAYLOAD), len(PAYLOAD))
+
+
+def test_hash_mismatch_discards_download(tmp_path):
+    path = str(tmp_path / "update.zip")
+    downloader = UpdateDownloader(None, "0" * 64, path)
+    with pytest.raises(UpdateError, match="хеша"):
+        download(release_app([]), downloader)
+    assert not os.path.exists(path)
+    assert not os.path.exists(path + ".part")
+
+
+def test_restarts_when_server_ignores_range(tmp_path):
+    requests = []
+    path = str(tmp_path / "update.zip")
+    # Часть не совпадает с началом файла: если бы её дописали, хеш бы не сошёлся
+    with open(path + ".part", "wb") as f:
+        f.write(b"x" * 1024)
+    downloader = UpdateDownloader(None, PAYLOAD_SHA, path)
+    assert download(release_app(requests, ranges=False), downloader) == path
+    assert requests == ["bytes=1024-"]
+    assert read(path) == PAYLOAD
+
+
+def interrupted_install(tmp_path, committed):
+    # Состояние после аварийного завершения: файл уже подменён, журнал остался
+    app_dir = tmp_path / "app"
+    installer = UpdateInstaller(str(app_dir), str(tmp_path / ".update"))
+    os.makedirs(installer.staging)
+    (app_dir / "main.py").parent.mkdir(parents=True, exist_ok=True)
+    (app_dir / "main.py").write_text("old")
+    (tmp_path / ".update" / "staging" / "main.py").write_text("new")
+    os.makedirs(installer.backup)
+    os.replace(app_dir / "main.py", os.path.join(installer.backup, "main.py"))
+    os.replace(os.path.join(installer.staging, "main.py"), app_dir / "main.py")
+    installer._write_journal({"committed": committed, "files": {"main.py": True}})
+    return installer, app_dir
+
+
+def test_recover_rolls_back_uncommitted_install(tmp_path):
+    installer, app_dir = interrupted_install(tmp_path, committed=False)
+    assert installer.recover() is True
+    assert (app_dir / "main.py").read_text() == "old"
+    assert not os.path.exists(installer.journal_path)
+
+
+def test_recover_keeps_committed_install(tmp_path):
+    installer, app_dir = interrupted_install(tmp_path, committed=True)
+    assert installer.recover() is False
+    assert (app_dir / "main.py").read_text() == "new"
+    assert not os.path.exists(installer.backup)
+    assert not os.path.exists(installer.journal_path)
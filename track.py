@@ -0,0 +1,161 @@
+import time
+from collections import namedtuple
+
+from covers import is_cover_url
+
+btns = [
+    {"label": "Github", "url": "https://github.com/Drakkkyla/vk-rpc-bridge"},
+    {"label": "VK", "url": "https://vk.com/draakylaaaa"}
+]
+
+
+# Ограничения Discord для текстовых полей активности (details, state, large_text) и адреса картинки
+DISCORD_TEXT_MIN = 2
+DISCORD_TEXT_MAX = 128
+DISCORD_IMAGE_MAX = 256
+
+
+def discord_text(value):
+    # Обрезка до лимита Discord; слишком короткое дополняется невидимым пробелом, иначе Discord отклонит статус
+    if len(value) > DISCORD_TEXT_MAX:
+        value = value[:DISCORD_TEXT_MAX - 1] + "…"
+    return value.ljust(DISCORD_TEXT_MIN, "\u200b")
+
+
+class TrackState(namedtuple("TrackState", "artist title album duration position paused cover", defaults=(None,))):
+    # Неизменяемое состояние трека: передаётся между потоками как есть, без сериализации.
+    # Сравнение - обычное сравнение кортежей.
+    __slots__ = ()
+
+    def same_track(self, other):
+        # Тот же трек (возможно, с другой позицией или паузой)
+        return other is not None and self[:3] == other[:3]
+
+
+def extrapolate_position(state, received_at, now):
+    # Позиция "сейчас" по последнему снимку (received_at и now - монотонные часы):
+    # во время воспроизведения идёт вместе с часами, на паузе стоит
+    if state.paused or state.duration <= 0:
+        return state.position
+    return max(0.0, min(state.duration, state.position + now - received_at))
+
+
+def build_activity(state, buttons, now=None):
+    if now is None:
+        now = time.time()
+    cover = state.cover if is_cover_url(state.cover) and len(state.cover) <= DISCORD_IMAGE_MAX else None
+    activity = {
+        "activity_type": 2,
+        "details": discord_text(state.artist),
+        "state": discord_text(state.title),
+        "buttons": buttons,
+        "large_image": cover or "embedded_cover",
+        "large_text": "VK Music",
+        "small_image": "vk_logo",
+        "small_text": "Слушает в VK"
+    }
+    if state.paused:
+        activity["small_image"] = "pause_icon"
+        activity["small_text"] = "Пауза"
+    if state.duration > 0 and state.position >= 0:
+        # AioPresence.update принимает start/end отдельными аргументами, а не словарь timestamps
+        activity["start"] = int(now - state.position)
+        activity["end"] = int(now - state.position + state.duration)
+    return activity
+
+
+# Схема song_changed: поле -> (тип, минимум, максимум); для строк границы - длина, для чисел - значение.
+# Обязательных полей нет: хук шлёт {artist, source} без songName, если в заголовке нет "—", -
+# такое событие корректно, но неполно, и очищает статус (TrackTracker вернёт None)
+SONG_FIELDS = {
+    "artist": (str, 0, 256),
+    "songName": (str, 0, 256),
+    "album": (str, 0, 256),
+    "cover": (str, 0, 2048),
+    "source": (str, 0, 32),
+    "duration": (float, 0, 86400),
+    "position": (float, 0, 86400),
+    "paused": (bool, None, None)
+}
+
+
+def validate_song(data):
+    # Проверка на входе до любого копирования и логирования: None - событие корректно, иначе причина.
+    # Неизвестные поля отклоняются, поэтому размер события ограничен самой схемой
+    if type(data) is not dict:
+        return "not_object"
+    if len(data) > len(SONG_FIELDS):
+        return "too_many_fields"
+    for key, value in data.items():
+        spec = SONG_FIELDS.get(key)
+        if spec is None:
+            return "unknown_field"
+        kind, low, high = spec
+        if kind is str:
+            # null (undefined в JS) - то же, что отсутствующее поле
+            if value is not None and (type(value) is not str or not low <= len(value) <= high):
+                return "bad_string"
+        elif kind is float:
+            # bool - подкласс int, но числом здесь не считается; NaN не проходит сравнение
+            if type(value) not in (int, float) or not low <= value <= high:
+                return "bad_number"
+        elif type(value) is not kind:
+            return "bad_type"
+    return None
+
+
+class TrackTracker:
+    # Сборка TrackState из событий хука: song_paused приходит без данных о треке
+    # и дополняется последним известным song_changed
+
+    def __init__(self):
+        self.current_song_data = None
+
+    def feed(self, data):
+        if 'artist' in data and 'songName' in data:
+            self.current_song_data = data.copy()
+        if 'paused' in data and not ('artist' in data and 'songName' in data) and self.current_song_data:
+            data = dict(self.current_song_data, paused=data['paused'])
+        # Хук делит заголовок по "—" и оставляет пробелы по краям
+        artist = (data.get('artist') or '').strip()
+        song_name = (data.get('songName') or '').strip()
+        if not artist or not song_name:
+            return None
+        album = data.get('album')
+        return TrackState(artist, song_name, album.strip() if album else album, data.get('duration', 0),
+                          data.get('position', 0), data.get('paused', False), data.get('cover'))
+
+
+# Допустимое расхождение позиции с ожидаемой (секунды), при котором событие не пересылается
+POSITION_DRIFT = 2.0
+
+_UNSET = object()
+
+
+class TimelineFilter:
+    # Отсекает тики позиции и перемотки, которые совпадают с ожидаемой временной шкалой:
+    # от последнего пересланного состояния позиция растёт вместе со временем (если не пауза).
+    # Пересылается смена трека, паузы, метаданных или расхождение больше drift.
+
+    def __init__(self, drift=POSITION_DRIFT, clock=time.monotonic):
+        self.drift = drift
+        self.clock = clock
+        self.last = _UNSET
+        self.last_time = 0.0
+        self.suppressed = 0
+
+    def accept(self, state):
+        now = self.clock()
+        last = self.last
+        if state is None or last is None or last is _UNSET:
+            if state is None and last is None:
+                self.suppressed += 1
+                return False
+        elif state._replace(position=0) == last._replace(position=0):
+            expected = last.position if last.paused else last.position + (now - self.last_time)
+            if abs(state.position - expected) <= self.drift:
+                self.suppressed += 1
+                return False
+        self.last = state
+        self.last_time = now
+        return True
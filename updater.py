@@ -0,0 +1,356 @@
+import hashlib
+import json
+import os
+import re
+import time
+
+UPDATE_FILE = "update.zip"
+# Рабочий каталог установки: staging (новые файлы), backup (заменённые), journal.json
+UPDATE_DIR = ".update"
+MANIFEST_NAME = "manifest.json"
+RELEASE_CACHE = os.path.join(UPDATE_DIR, "release.json")
+# Чаще этого GitHub API не опрашивается; между проверками используется кеш (секунды)
+RELEASE_CHECK_INTERVAL = 6 * 3600
+DOWNLOAD_CHUNK = 256 * 1024
+# Не чаще одного уведомления о прогрессе за этот интервал (секунды)
+PROGRESS_INTERVAL = 0.1
+DOWNLOAD_TIMEOUT = 30
+
+
+class UpdateError(Exception):
+    pass
+
+
+class DownloadCancelled(UpdateError):
+    pass
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+async def find_sha256(session, asset, assets):
+    # Опубликованный хеш: поле digest ассета GitHub ("sha256:...") или соседний файл <имя>.sha256
+    digest = asset.get("digest") or ""
+    if digest.startswith("sha256:"):
+        return digest.split(":", 1)[1].lower()
+    for candidate in assets:
+        if candidate.get("name") == asset.get("name", "") + ".sha256":
+            async with session.get(candidate["browser_download_url"]) as resp:
+                resp.raise_for_status()
+                match = re.search(r"\b[0-9a-fA-F]{64}\b", await resp.text())
+                if match:
+                    return match.group(0).lower()
+    return None
+
+
+class ReleaseCache:
+    # Метаданные последнего релиза на диске: ответ API, его ETag и время проверки.
+    # resolved - уже вычисленные по релизу данные обновления (хеши, манифест), чтобы не запрашивать их повторно
+
+    def __init__(self, path=RELEASE_CACHE, min_interval=RELEASE_CHECK_INTERVAL, clock=time.time):
+        self.path = path
+        self.min_interval = min_interval
+        self.clock = clock
+        self.etag = None
+        self.checked = 0.0
+        self.release = None
+        self.resolved = None
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            self.etag = data.get("etag")
+            self.checked = data.get("checked", 0.0)
+            self.release = data.get("release")
+            self.resolved = data.get("resolved")
+        except (OSError, ValueError):
+            pass
+
+    def fresh(self):
+        return self.release is not None and 0 <= self.clock() - self.checked < self.min_interval
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"etag": self.etag, "checked": self.checked, "release": self.release,
+                       "resolved": self.resolved}, f)
+        os.replace(tmp, self.path)
+
+
+async def fetch_latest_release(session, repo, cache):
+    # Не чаще cache.min_interval; повторный запрос условный (If-None-Match) -
+    # ответ 304 не расходует лимит GitHub API. При ошибке API возвращается кешированный релиз
+    if cache.fresh():
+        return cache.release
+    headers = {"Accept": "application/vnd.github+json"}
+    if cache.etag and cache.release is not None:
+        headers["If-None-Match"] = cache.etag
+    async with session.get(f"https://api.github.com/repos/{repo}/releases/latest", headers=headers) as resp:
+        if resp.status == 304:
+            cache.checked = cache.clock()
+        elif resp.status == 200:
+            release = await resp.json()
+            if cache.release is None or release.get("tag_name") != cache.release.get("tag_name"):
+                cache.resolved = None
+            cache.release = release
+            cache.etag = resp.headers.get("ETag")
+            cache.checked = cache.clock()
+        elif cache.release is None:
+            raise UpdateError(f"GitHub API: HTTP {resp.status}")
+        else:
+            return cache.release
+    cache.save()
+    return cache.release
+
+
+class UpdateDownloader:
+    # Потоковая загрузка без искусственных пауз: SHA-256 считается по ходу,
+    # прогресс сообщается не чаще PROGRESS_INTERVAL, прерванная загрузка докачивается через Range.
+    # on_progress(downloaded, total) - total может быть None, если размер неизвестен.
+
+    def __init__(self, url, sha256, path=UPDATE_FILE, on_progress=None, chunk_size=DOWNLOAD_CHUNK):
+        self.url = url
+        self.sha256 = sha256.lower() if sha256 else None
+        self.path = path
+        self.part_path = path + ".part"
+        self.on_progress = on_progress or (lambda downloaded, total: None)
+        self.chunk_size = chunk_size
+        self.cancelled = False
+
+    def _already_downloaded(self):
+        return os.path.exists(self.path) and file_sha256(self.path) == self.sha256
+
+    def _resume_offset(self, digest):
+        # Уже скачанная часть сразу учитывается в хеше
+        if not os.path.exists(self.part_path):
+            return 0
+        offset = 0
+        with open(self.part_path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+                offset += len(block)
+        return offset
+
+    @staticmethod
+    def _total(resp, offset):
+        content_range = resp.headers.get("Content-Range", "")
+        if "/" in content_range:
+            size = content_range.rsplit("/", 1)[1]
+            if size.isdigit():
+                return int(size)
+        if resp.content_length:
+            return resp.content_length + offset
+        return None
+
+    async def download(self, session):
+        from aiohttp import ClientTimeout
+        if not self.sha256:
+            raise UpdateError("Релиз не содержит SHA-256 для проверки")
+        if self._already_downloaded():
+            return self.path
+        digest = hashlib.sha256()
+        offset = self._resume_offset(digest)
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        async with session.get(self.url, headers=headers,
+                               timeout=ClientTimeout(total=None, sock_read=DOWNLOAD_TIMEOUT)) as resp:
+            if resp.status == 416 and offset:
+                # Часть уже полная (или файл на сервере сменился) - проверяем то, что есть
+                total = offset
+            elif resp.status == 206 and offset:
+                total = self._total(resp, offset)
+            elif resp.status == 200:
+                if offset:
+                    # Сервер не поддерживает Range - начинаем заново
+                    digest = hashlib.sha256()
+                    offset = 0
+                total = self._total(resp, 0)
+            else:
+                raise UpdateError(f"HTTP {resp.status}")
+
+            downloaded = offset
+            if resp.status != 416:
+                mode = "ab" if offset else "wb"
+                last_report = 0.0
+                with open(self.part_path, mode) as f:
+                    async for chunk in resp.content.iter_chunked(self.chunk_size):
+                        if self.cancelled:
+                            raise DownloadCancelled("Отменено")
+                        f.write(chunk)
+                        digest.update(chunk)
+                        downloaded += len(chunk)
+                        now = time.monotonic()
+                        if now - last_report >= PROGRESS_INTERVAL:
+                            last_report = now
+                            self.on_progress(downloaded, total)
+            self.on_progress(downloaded, total)
+
+        if total is not None and downloaded != total:
+            raise UpdateError("Загрузка прервана, будет продолжена при следующей попытке")
+        if digest.hexdigest() != self.sha256:
+            os.remove(self.part_path)
+            raise UpdateError("Ошибка проверки хеша")
+        os.replace(self.part_path, self.path)
+        return self.path
+
+
+def safe_relpath(name):
+    # Путь из манифеста или архива не должен выходить за пределы каталога приложения
+    path = os.path.normpath(name.replace("\\", "/"))
+    if os.path.isabs(path) or path == ".." or path.startswith(".." + os.sep) or os.path.splitdrive(path)[0]:
+        raise UpdateError(f"Недопустимый путь в обновлении: {name}")
+    return path
+
+
+def changed_files(manifest, app_dir="."):
+    # Файлы манифеста, которых нет локально или у которых другой хеш
+    changed = []
+    for name, info in manifest.get("files", {}).items():
+        rel = safe_relpath(name)
+        target = os.path.join(app_dir, rel)
+        if not os.path.isfile(target) or file_sha256(target) != info["sha256"].lower():
+            changed.append((name, rel, info))
+    return changed
+
+
+class UpdateInstaller:
+    # Установка через промежуточный каталог: новые файлы сначала собираются в .update/staging,
+    # затем подменяются os.replace. Журнал позволяет откатиться при ошибке и после аварийного завершения.
+
+    def __init__(self, app_dir=".", work_dir=UPDATE_DIR):
+        self.app_dir = app_dir
+        self.work_dir = work_dir
+        self.staging = os.path.join(work_dir, "staging")
+        self.backup = os.path.join(work_dir, "backup")
+        self.journal_path = os.path.join(work_dir, "journal.json")
+        # Текущая загрузка файла - через неё UpdateManager отменяет скачивание
+        self.downloader = None
+        self.cancelled = False
+
+    def reset_staging(self):
+        import shutil
+        shutil.rmtree(self.staging, ignore_errors=True)
+        os.makedirs(self.staging, exist_ok=True)
+
+    def stage_zip(self, zip_path):
+        import shutil
+        import zipfile
+        self.reset_staging()
+        with zipfile.ZipFile(zip_path) as archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                target = os.path.join(self.staging, safe_relpath(info.filename))
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                with archive.open(info) as src, open(target, "wb") as dst:
+                    shutil.copyfileobj(src, dst, DOWNLOAD_CHUNK)
+
+    async def stage_manifest(self, session, manifest, base_url, on_progress=None):
+        # Скачиваются только изменённые файлы, каждый проверяется по своему SHA-256.
+        # Возвращает (число файлов, байт)
+        on_progress = on_progress or (lambda downloaded, total: None)
+        changed = changed_files(manifest, self.app_dir)
+        # Уже подготовленные файлы с верным хешем не скачиваются заново (см. UpdateDownloader),
+        # лишнее из прошлых попыток удаляется
+        wanted = {rel for name, rel, info in changed}
+        for rel in self.staged_files():
+            if (rel[:-5] if rel.endswith(".part") else rel) not in wanted:
+                os.remove(os.path.join(self.staging, rel))
+        total = sum(info.get("size", 0) for name, rel, info in changed) or None
+        done = 0
+        for name, rel, info in changed:
+            if self.cancelled:
+                raise DownloadCancelled("Отменено")
+            target = os.path.join(self.staging, rel)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+
+            def report(downloaded, _, base=done):
+                on_progress(base + downloaded, total)
+
+            self.downloader = UpdateDownloader(base_url + name.replace("\\", "/"), info["sha256"], path=target,
+                                               on_progress=report)
+            self.downloader.cancelled = self.cancelled
+            await self.downloader.download(session)
+            done += os.path.getsize(target)
+        self.downloader = None
+        return len(changed), done
+
+    def staged_files(self):
+        files = []
+        for root, dirs, names in os.walk(self.staging):
+            for name in names:
+                files.append(os.path.relpath(os.path.join(root, name), self.staging))
+        return files
+
+    def _write_journal(self, journal):
+        tmp = self.journal_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(journal, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.journal_path)
+
+    def install(self):
+        files = self.staged_files()
+        if not files:
+            raise UpdateError("Нет подготовленных файлов обновления")
+        journal = {
+            "committed": False,
+            "files": {rel: os.path.exists(os.path.join(self.app_dir, rel)) for rel in files}
+        }
+        os.makedirs(self.backup, exist_ok=True)
+        self._write_journal(journal)
+        try:
+            for rel in files:
+                target = os.path.join(self.app_dir, rel)
+                if os.path.exists(target):
+                    backup = os.path.join(self.backup, rel)
+                    os.makedirs(os.path.dirname(backup), exist_ok=True)
+                    os.replace(target, backup)
+                os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+                os.replace(os.path.join(self.staging, rel), target)
+        except Exception:
+            self.rollback()
+            raise
+        journal["committed"] = True
+        self._write_journal(journal)
+        self.cleanup()
+        return len(files)
+
+    def rollback(self):
+        # True, если файлы действительно возвращены из резервной копии
+        try:
+            with open(self.journal_path, encoding="utf-8") as f:
+                journal = json.load(f)
+        except (OSError, ValueError):
+            journal = None
+        rolled_back = bool(journal) and not journal.get("committed")
+        if rolled_back:
+            for rel, existed in journal["files"].items():
+                target = os.path.join(self.app_dir, rel)
+                backup = os.path.join(self.backup, rel)
+                if os.path.exists(backup):
+                    os.replace(backup, target)
+                elif not existed and os.path.exists(target):
+                    os.remove(target)
+        self.cleanup()
+        return rolled_back
+
+    def recover(self):
+        # При запуске: незавершённая установка откатывается (True), от завершённой только удаляются остатки
+        if not os.path.exists(self.journal_path):
+            return False
+        return self.rollback()
+
+    def cleanup(self):
+        import shutil
+        shutil.rmtree(self.staging, ignore_errors=True)
+        shutil.rmtree(self.backup, ignore_errors=True)
+        try:
+            os.remove(self.journal_path)
+        except OSError:
+            pass